@@ -1,29 +1,198 @@
 # alert.py
 
+import atexit
 import logging
+import queue
+import threading
+import time
 import requests
-from config import ALERT_EMAIL, ALERT_WEBHOOK_URL, LOG_LEVEL
+from requests.adapters import HTTPAdapter
+from index_codec import encode_indices
+from config import (
+    ALERT_EMAIL, ALERT_WEBHOOK_URL, ALERT_TIMEOUT_SECONDS, ALERT_QUEUE_SIZE,
+    ALERT_COALESCE_SECONDS, ALERT_SUPPRESS_SECONDS, ALERT_RATE_LIMIT,
+    ALERT_MAX_RETRIES, ALERT_BACKOFF_SECONDS, ALERT_POOL_SIZE,
+    ALERT_INDEX_ENCODING, LOG_LEVEL,
+)
 
 logging.basicConfig(level=LOG_LEVEL)
 
+def _new_session(pool_size=ALERT_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_session = None
+
+def _encode_payload_indices(threat_indices, encoding):
+    # Plain JSON array for "list", an index_codec payload otherwise
+    if encoding == "list":
+        return [int(i) for i in threat_indices]
+    return encode_indices(threat_indices, encoding)
+
 def send_console_alert(threat_indices):
-    if not threat_indices:
+    if threat_indices is None or len(threat_indices) == 0:
         logging.info("No threats to alert.")
         return
     logging.warning(f"Threats detected at indices: {threat_indices}")
 
-def send_webhook_alert(threat_indices):
-    if not threat_indices:
+def send_webhook_alert(threat_indices, encoding=ALERT_INDEX_ENCODING):
+    global _session
+    if threat_indices is None or len(threat_indices) == 0:
         return
+    if _session is None:
+        _session = _new_session()
     payload = {
         "alert": "Threats detected",
-        "indices": threat_indices
+        "indices": _encode_payload_indices(threat_indices, encoding)
     }
     try:
-        response = requests.post(ALERT_WEBHOOK_URL, json=payload)
+        response = _session.post(ALERT_WEBHOOK_URL, json=payload, timeout=ALERT_TIMEOUT_SECONDS)
         if response.status_code == 200:
             logging.info("Webhook alert sent successfully.")
         else:
             logging.error(f"Webhook alert failed: {response.status_code}")
     except Exception as e:
         logging.error(f"Error sending webhook alert: {e}")
+
+_STOP = object()
+
+class AlertDispatcher:
+    # Sends webhook alerts from a background thread so detection never waits
+    # on the network. Alerts for the same key are coalesced within a window,
+    # identical repeats are suppressed, posts are rate limited and failed
+    # posts are retried with exponential backoff.
+
+    def __init__(self, url=ALERT_WEBHOOK_URL, queue_size=ALERT_QUEUE_SIZE,
+                 coalesce_seconds=ALERT_COALESCE_SECONDS, suppress_seconds=ALERT_SUPPRESS_SECONDS,
+                 rate_limit=ALERT_RATE_LIMIT, max_retries=ALERT_MAX_RETRIES,
+                 backoff_seconds=ALERT_BACKOFF_SECONDS, timeout=ALERT_TIMEOUT_SECONDS,
+                 session=None, encoding=ALERT_INDEX_ENCODING):
+        self.url = url
+        self.encoding = encoding
+        self.coalesce_seconds = coalesce_seconds
+        self.suppress_seconds = suppress_seconds
+        self.min_interval = 1.0 / rate_limit if rate_limit else 0.0
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.stats = {"submitted": 0, "dropped": 0, "suppressed": 0, "sent": 0, "failed": 0, "retries": 0}
+
+        self._session = session or _new_session()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._last_sent = {}  # key -> (indices, monotonic time), pruned after suppress_seconds
+        self._next_post = 0.0
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="AlertDispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, threat_indices, key="default"):
+        # Never blocks: a full queue drops the alert and counts it
+        if threat_indices is None or len(threat_indices) == 0:
+            return False
+        try:
+            self._queue.put_nowait((key, list(threat_indices)))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logging.warning("Alert queue full, dropping alert.")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def close(self, timeout=None):
+        # Flushes everything queued or coalescing, then stops the worker. The
+        # sentinel only wakes an idle worker; with a full queue the worker is
+        # busy and stops by itself once _closing is set and the queue drained.
+        if self._thread.is_alive():
+            self._closing.set()
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def _run(self):
+        pending = {}  # key -> set of indices
+        deadline = None
+        while True:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self._closing.is_set():
+                wait = 0.0  # draining for close(): never block on an empty queue
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or (item is None and self._closing.is_set()):
+                self._flush(pending)
+                return
+            if item is not None:
+                key, indices = item
+                pending.setdefault(key, set()).update(indices)
+                if deadline is None:
+                    deadline = time.monotonic() + self.coalesce_seconds
+            if deadline is not None and time.monotonic() >= deadline:
+                self._flush(pending)
+                pending, deadline = {}, None
+
+    def _flush(self, pending):
+        # Entries past the suppression window can no longer suppress anything
+        now = time.monotonic()
+        self._last_sent = {key: last for key, last in self._last_sent.items()
+                           if now - last[1] < self.suppress_seconds}
+        for key, indices in pending.items():
+            indices = sorted(indices)
+            last = self._last_sent.get(key)
+            if last and last[0] == indices and time.monotonic() - last[1] < self.suppress_seconds:
+                self.stats["suppressed"] += 1
+                continue
+            payload = {"alert": "Threats detected", "key": key,
+                       "indices": _encode_payload_indices(indices, self.encoding)}
+            if self._post(payload):
+                self._last_sent[key] = (indices, time.monotonic())
+
+    def _post(self, payload):
+        for attempt in range(self.max_retries + 1):
+            # Rate limit: space posts at least min_interval apart
+            delay = self._next_post - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_post = time.monotonic() + self.min_interval
+
+            try:
+                response = self._session.post(self.url, json=payload, timeout=self.timeout)
+                if 200 <= response.status_code < 300:
+                    self.stats["sent"] += 1
+                    logging.info("Webhook alert sent successfully.")
+                    return True
+                # Client errors other than throttling will not succeed on retry
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+                logging.warning(f"Webhook alert failed: {response.status_code}")
+            except requests.RequestException as e:
+                logging.warning(f"Error sending webhook alert: {e}")
+
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                time.sleep(self.backoff_seconds * 2 ** attempt)
+
+        self.stats["failed"] += 1
+        logging.error(f"Webhook alert for {payload['key']} failed after {attempt + 1} attempts.")
+        return False
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_alert_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher()
+            # Give queued alerts a chance to go out before the process exits
+            atexit.register(_dispatcher.close, ALERT_TIMEOUT_SECONDS * (ALERT_MAX_RETRIES + 1))
+        return _dispatcher
+
+def dispatch_webhook_alert(threat_indices, key="default"):
+    return get_alert_dispatcher().submit(threat_indices, key=key)
@@ -1,24 +1,134 @@
 # api.py
 
+import json
+import zlib
+from itertools import chain
 import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from data_loader import preprocess_logs
-from feature_engineering import extract_features
+from feature_engineering import extract_features, build_model_input
 from detector import detect_threats
+from index_codec import ENCODINGS, encode_indices
+from config import BULK_CHUNK_ROWS, BULK_READ_BYTES
 
 app = Flask(__name__)
 
+def _requested_encoding():
+    # ?encoding=list|ranges|bitmap|auto switches threat_indices to an
+    # index_codec payload; without it the response is a plain JSON list
+    encoding = request.args.get("encoding")
+    if encoding is not None and encoding not in ENCODINGS:
+        raise ValueError(f"encoding must be one of {', '.join(ENCODINGS)}")
+    return encoding
+
 @app.route("/detect", methods=["POST"])
 def detect():
+    try:
+        encoding = _requested_encoding()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         data = request.get_json()
         df = preprocess_logs(pd.DataFrame(data))
-        features = extract_features(df)
-        threats = detect_threats(features)
-        return jsonify({"threat_indices": threats}), 200
+        features = build_model_input(extract_features(df), df)
+        threats = detect_threats(features, logs=df, as_array=True)
+        if encoding is None:
+            return jsonify({"threat_indices": threats.tolist()}), 200
+        payload = encode_indices(threats, encoding, start=0, length=features.shape[0])
+        return jsonify({"threat_indices": payload}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _iter_body(stream, read_bytes=BULK_READ_BYTES):
+    # Plain read() calls only: WSGI input streams (LimitedStream, raw
+    # wsgi.input on chunked uploads) need not support peek or readinto
+    while True:
+        data = stream.read(read_bytes)
+        if not data:
+            return
+        yield data
+
+def _gunzip(blocks):
+    # Streaming gzip decode; concatenated members (e.g. appended gzip files)
+    # each start a new decompressor
+    decompressor = zlib.decompressobj(wbits=31)
+    for data in blocks:
+        while data:
+            yield decompressor.decompress(data)
+            data = decompressor.unused_data if decompressor.eof else b""
+            if data:
+                decompressor = zlib.decompressobj(wbits=31)
+    yield decompressor.flush()
+
+def _iter_lines(blocks):
+    pending = b""
+    for data in blocks:
+        *lines, pending = (pending + data).split(b"\n")
+        yield from lines
+    if pending:
+        yield pending
+
+def _iter_ndjson_chunks(lines, chunk_rows):
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        chunk.append(json.loads(line))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+@app.route("/detect/bulk", methods=["POST"])
+def detect_bulk():
+    # Accepts NDJSON (optionally gzip-compressed) and streams one NDJSON result
+    # line per chunk, so memory stays flat regardless of the upload size.
+    chunk_rows = request.args.get("chunk_rows", BULK_CHUNK_ROWS, type=int)
+    if not chunk_rows or chunk_rows <= 0:
+        return jsonify({"error": "chunk_rows must be a positive integer"}), 400
+    try:
+        encoding = _requested_encoding()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    blocks = _iter_body(request.stream)
+    head = b""
+    for data in blocks:
+        # Enough bytes to sniff the gzip magic number
+        head += data
+        if len(head) >= 2:
+            break
+    blocks = chain([head], blocks)
+    if request.headers.get("Content-Encoding", "").lower() == "gzip" or head[:2] == b"\x1f\x8b":
+        blocks = _gunzip(blocks)
+
+    def generate():
+        offset = 0
+        try:
+            for index, records in enumerate(_iter_ndjson_chunks(_iter_lines(blocks), chunk_rows)):
+                df = preprocess_logs(pd.DataFrame(records))
+                features = build_model_input(extract_features(df), df)
+                # Map positions in the cleaned chunk back to record numbers in the upload
+                positions = detect_threats(features, logs=df, as_array=True)
+                threats = df.index.to_numpy()[positions] + offset
+                if encoding is None:
+                    threats = threats.tolist()
+                else:
+                    threats = encode_indices(threats, encoding, start=offset, length=len(records))
+                yield json.dumps({
+                    "chunk": index,
+                    "offset": offset,
+                    "rows": len(records),
+                    "threat_indices": threats,
+                }) + "\n"
+                offset += len(records)
+        except Exception as e:
+            yield json.dumps({"offset": offset, "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @app.route("/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "ok"}), 200
@@ -28,9 +138,14 @@ if __name__ == "__main__":
 
 
 # Run the API
-python api.py
+# python api.py
 
 # Example POST request
-curl -X POST http://localhost:5000/detect \
-     -H "Content-Type: application/json" \
-     -d '[{"timestamp":"2025-09-28T12:00:00","source_ip":"192.168.1.1","message":"unauthorized access"}]'
+# curl -X POST http://localhost:5000/detect \
+#      -H "Content-Type: application/json" \
+#      -d '[{"timestamp":"2025-09-28T12:00:00","source_ip":"192.168.1.1","message":"unauthorized access"}]'
+
+# Example bulk request (gzip-compressed NDJSON, one result line per chunk)
+# gzip -c logs.ndjson | curl -X POST "http://localhost:5000/detect/bulk?chunk_rows=5000" \
+#      -H "Content-Type: application/x-ndjson" -H "Content-Encoding: gzip" \
+#      --data-binary @-
@@ -0,0 +1,182 @@
+# compact_model.py
+
+import logging
+import os
+import numpy as np
+from config import COMPACT_SCORE_CHUNK_ROWS, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+_EULER_GAMMA = 0.5772156649015329
+
+def _average_path_length(n_samples):
+    # c(n) from the Isolation Forest paper: average path length of an
+    # unsuccessful BST search over n samples
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    big = n > 2
+    result[big] = 2.0 * (np.log(n[big] - 1.0) + _EULER_GAMMA) - 2.0 * (n[big] - 1.0) / n[big]
+    return result
+
+class CompactForest:
+    # A fitted IsolationForest flattened into contiguous node arrays. Every
+    # tree lives in the same arrays, rooted at roots[t]; leaves point to
+    # themselves so all trees can be walked in lockstep for a whole batch.
+    # feature ids index into columns, the input columns any split uses, so
+    # wide sparse inputs only densify those few columns one chunk at a time.
+    # Exposes the score_samples / decision_function / predict trio the
+    # detector calls, without importing sklearn.
+
+    def __init__(self, columns, feature, threshold, left, right, leaf_depth, roots,
+                 offset, max_samples, feature_names=None):
+        self.columns = np.asarray(columns, dtype=np.intp)
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.leaf_depth = np.asarray(leaf_depth, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.offset_ = float(offset)
+        self.max_samples = int(max_samples)
+        self.feature_names_in_ = None if feature_names is None else np.asarray(feature_names, dtype=object)
+
+        # right children then left, so a node's next hop is children[node + go_left * n]
+        self._children = np.concatenate([self.right, self.left]).astype(np.intp)
+        self._max_depth = self._tree_depth()
+        self._denominator = len(self.roots) * float(_average_path_length([self.max_samples])[0])
+
+    @classmethod
+    def from_sklearn(cls, model):
+        feature, threshold, left, right, leaf_depth, roots = [], [], [], [], [], []
+        start = 0
+        for estimator, columns in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            is_leaf = tree.children_left == -1
+            nodes = np.arange(n_nodes, dtype=np.int32)
+
+            # Tree-local feature ids refer to the estimator's column subset
+            columns = np.asarray(columns)
+            tree_feature = np.where(is_leaf, 0, columns[np.where(is_leaf, 0, tree.feature)])
+            tree_left = np.where(is_leaf, nodes, tree.children_left) + start
+            tree_right = np.where(is_leaf, nodes, tree.children_right) + start
+
+            # Leaf value = edges from the root + c(samples left in the leaf),
+            # rounded exactly as sklearn's (node depth + c(n)) - 1
+            depth = np.zeros(n_nodes, dtype=np.float64)
+            frontier, level = np.array([0]), 0
+            while frontier.size:
+                depth[frontier] = level
+                frontier = frontier[~is_leaf[frontier]]
+                frontier = np.concatenate([tree.children_left[frontier], tree.children_right[frontier]])
+                level += 1
+
+            feature.append(tree_feature)
+            threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+            left.append(tree_left)
+            right.append(tree_right)
+            leaf_depth.append((depth + 1.0 + _average_path_length(tree.n_node_samples)) - 1.0)
+            roots.append(start)
+            start += n_nodes
+
+        # Renumber features over the columns actually split on
+        columns, feature = np.unique(np.concatenate(feature), return_inverse=True)
+        return cls(
+            columns, feature, np.concatenate(threshold),
+            np.concatenate(left), np.concatenate(right),
+            np.concatenate(leaf_depth), roots,
+            offset=model.offset_, max_samples=model.max_samples_,
+            feature_names=getattr(model, "feature_names_in_", None),
+        )
+
+    def _tree_depth(self):
+        # Number of lockstep steps needed for every root to reach a leaf
+        frontier, steps = self.roots, 0
+        while True:
+            frontier = frontier[self.left[frontier] != frontier]
+            if frontier.size == 0:
+                return steps
+            frontier = np.concatenate([self.left[frontier], self.right[frontier]])
+            steps += 1
+
+    def _as_array(self, X):
+        if hasattr(X, "columns") and self.feature_names_in_ is not None:
+            X = X[list(self.feature_names_in_)]
+        if hasattr(X, "tocsr"):
+            # scipy.sparse: kept sparse here, chunks are densified in _path_lengths
+            return X.tocsr()
+        return np.asarray(X)
+
+    def _dense_chunk(self, X, start):
+        chunk = X[start:start + COMPACT_SCORE_CHUNK_ROWS][:, self.columns]
+        if hasattr(chunk, "toarray"):
+            chunk = chunk.toarray()
+        # Trees compare float32 inputs against float64 thresholds, as sklearn does
+        return np.ascontiguousarray(chunk, dtype=np.float32)
+
+    def _path_lengths(self, X):
+        # All trees advance one level per step for a chunk of rows; take()
+        # on flat arrays keeps each step to a handful of vectorized gathers.
+        n_nodes, n_features = len(self.feature), len(self.columns)
+        roots = self.roots.astype(np.intp)
+        depths = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], COMPACT_SCORE_CHUNK_ROWS):
+            chunk = self._dense_chunk(X, start)
+            values = chunk.ravel()
+            row_base = (np.arange(chunk.shape[0], dtype=np.intp) * n_features)[:, None]
+            node = np.broadcast_to(roots, (chunk.shape[0], len(roots)))
+            for _ in range(self._max_depth):
+                go_left = values.take(row_base + self.feature.take(node)) <= self.threshold.take(node)
+                node = self._children.take(node + go_left * n_nodes)
+            # Accumulate tree by tree, in sklearn's order, so scores tied at
+            # offset_ land on the same side of it
+            total = np.zeros(chunk.shape[0], dtype=np.float64)
+            for tree_depths in self.leaf_depth.take(node).T:
+                total += tree_depths
+            depths[start:start + chunk.shape[0]] = total
+        return depths
+
+    def score_samples(self, X):
+        X = self._as_array(X)
+        if self._denominator == 0:
+            return -np.ones(X.shape[0], dtype=np.float64)
+        return -(2.0 ** (-self._path_lengths(X) / self._denominator))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.columns, self.feature, self.threshold, self.left,
+                                      self.right, self.leaf_depth, self.roots, self._children))
+
+    def save(self, path):
+        # Same tmp-file + rename dance as model.save_model
+        tmp_path = f"{path}.tmp.npz"
+        arrays = dict(
+            columns=self.columns, feature=self.feature, threshold=self.threshold, left=self.left,
+            right=self.right, leaf_depth=self.leaf_depth, roots=self.roots,
+            offset=np.float64(self.offset_), max_samples=np.int64(self.max_samples),
+        )
+        if self.feature_names_in_ is not None:
+            arrays["feature_names"] = self.feature_names_in_.astype(str)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        logging.debug(f"Compact model arrays: {self.nbytes} bytes")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["columns"], data["feature"], data["threshold"], data["left"], data["right"],
+                data["leaf_depth"], data["roots"],
+                offset=data["offset"], max_samples=data["max_samples"],
+                feature_names=data["feature_names"] if "feature_names" in data else None,
+            )
@@ -3,16 +3,138 @@
 # Paths
 LOG_DATA_PATH = "data/logs.csv"
 MODEL_PATH = "models/threat_model.pkl"
+COMPACT_MODEL_PATH = "models/threat_model.npz"
+FOLLOW_CHECKPOINT_PATH = "data/follow_checkpoint.json"
+WAREHOUSE_WATERMARK_PATH = "data/warehouse_watermarks.json"
+RESULT_STORE_PATH = "data/results"  # day-partitioned flagged rows (result_store.py)
+
+# Multi-file loading: columns read from each file and parser processes
+# (None = one per CPU)
+LOG_COLUMNS = ["timestamp", "source_ip", "message"]
+LOADER_MAX_WORKERS = None
+
+# Follow mode: micro-batches are flushed at FOLLOW_BATCH_ROWS rows or after
+# FOLLOW_BATCH_SECONDS, whichever comes first
+FOLLOW_BATCH_ROWS = 10000
+FOLLOW_BATCH_SECONDS = 5
+FOLLOW_POLL_SECONDS = 1
+FOLLOW_READ_BYTES = 8 * 1024 * 1024
+# Without a saved model, follow mode holds rows back until this many have
+# arrived and trains the first model on them
+FOLLOW_MIN_TRAIN_ROWS = 1000
+# Add sliding-window per-IP counts (streaming_features.IPWindowCounter, see
+# IP_COUNT_WINDOWS) to follow-mode features; the counter state is saved with
+# the checkpoint. The model must be trained on the same columns, so it is
+# off by default: turn it on with a model trained in follow mode.
+FOLLOW_IP_WINDOW_COUNTS = False
+
+# Timestamp parsing: rows sampled to detect a source's format
+TIMESTAMP_SAMPLE_SIZE = 1000
+
+# Model training. MODEL_MAX_SAMPLES is "auto", a row count or a fraction.
+MODEL_N_ESTIMATORS = 100
+MODEL_MAX_SAMPLES = "auto"
+MODEL_N_JOBS = None   # None = single core, -1 = all cores
+MODEL_CONTAMINATION = 0.1
+# Incremental refresh: trees fitted on recent data per run (the same number
+# of oldest trees is retired)
+MODEL_INCREMENTAL_REFRESH = False
+MODEL_REFRESH_TREES = 20
+# Sampled training (training_sample.py): one pass over all logs, streamed in
+# TRAIN_SAMPLE_BATCH_ROWS chunks, keeps a uniform reservoir of at most
+# TRAIN_SAMPLE_SIZE feature rows (split evenly across strata when
+# TRAIN_SAMPLE_STRATIFY is "hour" or "source")
+TRAIN_SAMPLE_SIZE = 100000
+TRAIN_SAMPLE_STRATIFY = None
+TRAIN_SAMPLE_BATCH_ROWS = 100000
+
+# Sharded detection: frames larger than DETECT_SHARD_ROWS are scored across
+# DETECT_WORKERS processes (None = single process)
+DETECT_WORKERS = None
+DETECT_SHARD_ROWS = 100000
+# Artifact the detector scores with: MODEL_PATH, or COMPACT_MODEL_PATH for the
+# flattened numpy scorer (no sklearn import). Loaders pick by file suffix.
+DETECT_MODEL_PATH = MODEL_PATH
+COMPACT_SCORE_CHUNK_ROWS = 1024
+# Score each distinct feature row once and fan the result back out
+DETECT_DEDUP = True
+# Cascade prefilter: rows that pass every benign rule are treated as normal
+# without reaching the model. Rules: "no_keywords" (suspicious_flag == 0),
+# "business_hours" (hour in [start, end)), "known_good_source" (source IP in
+# one of the networks; needs the preprocessed logs).
+DETECT_CASCADE = False
+CASCADE_RULES = ("no_keywords", "business_hours", "known_good_source")
+CASCADE_BUSINESS_HOURS = (8, 18)
+CASCADE_KNOWN_GOOD_NETWORKS = ["10.0.0.0/8", "192.168.0.0/16"]
+
+# Result store: loaded parts kept in memory per process (LRU)
+RESULT_STORE_CACHE_PARTS = 256
 
 # Detection thresholds
 ANOMALY_THRESHOLD = 0.7  # Adjust based on model calibration
 
+# Subnet prefix lengths with an ip_subnet<N>_freq feature (see ip_utils.py)
+IP_SUBNET_PREFIXES = (24, 16)
+
+# Hashed message n-grams appended to the model input as a scipy.sparse matrix
+# (stateless hashing trick, no fitted vocabulary). Memory follows the non-zero
+# tokens, but IsolationForest training time grows with the width.
+TEXT_HASH_FEATURES = False
+TEXT_HASH_WIDTH = 2 ** 12
+TEXT_NGRAM_RANGE = (1, 2)
+
+# Suspicious keyword families (see keyword_matcher.py). A relative path is
+# resolved against the repo root; None uses DEFAULT_KEYWORD_FAMILIES.
+KEYWORD_FAMILIES_PATH = "config/keywords.yaml"
+DEFAULT_KEYWORD_FAMILIES = {"suspicious": ["unauthorized", "failed", "error"]}
+
+# Warehouse writes: rows per insert batch / transaction
+INSERT_BATCH_SIZE = 10000
+# Warehouse reads: rows per fetched batch
+FETCH_BATCH_SIZE = 50000
+
+# Rule-based threat scoring (see threat_scoring.py). Each rule's points are
+# weight * value, capped per rule; the total is capped at "total".
+THREAT_SCORE_WEIGHTS = {"suspicious_flag": 50, "ip_freq": 5, "off_hours": 2}
+THREAT_SCORE_CAPS = {"ip_freq": 30, "total": 100}
+# Share of the IsolationForest anomaly score in the combined ranking score
+THREAT_SCORE_ANOMALY_WEIGHT = 0.5
+
+# Flask /detect/bulk: records scored per streamed chunk, and bytes read from
+# the request body at a time
+BULK_CHUNK_ROWS = 5000
+BULK_READ_BYTES = 64 * 1024
+
+# Dashboard: above DASHBOARD_MAX_POINTS rows the plot switches to a density
+# grid with all threat points and a sample of normal points
+DASHBOARD_MAX_POINTS = 50000
+DASHBOARD_GRID_BINS = 50
+DASHBOARD_NORMAL_SAMPLE = 5000
+DASHBOARD_MAX_LISTED_INDICES = 1000
+
 # Alert settings
 ALERT_EMAIL = "security@yourdomain.com"
 ALERT_WEBHOOK_URL = "https://your-alert-endpoint.com/webhook"
+ALERT_TIMEOUT_SECONDS = 5
+ALERT_QUEUE_SIZE = 1000
+ALERT_COALESCE_SECONDS = 2.0   # alerts for the same key within this window are merged
+ALERT_SUPPRESS_SECONDS = 300   # identical alerts for a key are not resent within this window
+ALERT_RATE_LIMIT = 5           # max webhook posts per second
+ALERT_MAX_RETRIES = 3
+ALERT_BACKOFF_SECONDS = 0.5    # doubled after every failed attempt
+ALERT_POOL_SIZE = 4
+# How webhook payloads carry indices: "list" (plain JSON array) or an
+# index_codec encoding ("ranges", "bitmap", "auto")
+ALERT_INDEX_ENCODING = "list"
 
 # Logging
 LOG_LEVEL = "INFO"
 
 # Misc
 RANDOM_SEED = 42
+
+# Streaming per-IP window counts (name -> window length in seconds)
+IP_COUNT_WINDOWS = {"1m": 60, "5m": 300, "1h": 3600}
+IP_COUNT_BUCKET_SECONDS = 30
+IP_SKETCH_WIDTH = 2 ** 14
+IP_SKETCH_DEPTH = 4
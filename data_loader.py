@@ -1,12 +1,34 @@
 # data_loader.py
 
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import logging
-from config import LOG_DATA_PATH, LOG_LEVEL
+from config import (
+    LOG_DATA_PATH, LOG_LEVEL, FOLLOW_BATCH_ROWS, FOLLOW_BATCH_SECONDS,
+    FOLLOW_POLL_SECONDS, FOLLOW_READ_BYTES, LOG_COLUMNS, LOADER_MAX_WORKERS,
+)
+from ip_utils import ip_columns
+from timestamp_parser import parse_timestamps
 
 logging.basicConfig(level=LOG_LEVEL)
 
+LOG_FILE_SUFFIXES = (".csv", ".csv.gz", ".jsonl", ".jsonl.gz", ".parquet")
+
 def load_log_data(path=LOG_DATA_PATH):
+    # Directories and globs go through the multi-file loader
+    if os.path.isdir(path) or glob.has_magic(path):
+        batches = list(load_log_batches(path))
+        df = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+        logging.info(f"Loaded data from {path} with shape {df.shape}")
+        return df
     try:
         df = pd.read_csv(path)
         logging.info(f"Loaded data from {path} with shape {df.shape}")
@@ -15,14 +37,278 @@ def load_log_data(path=LOG_DATA_PATH):
         logging.error(f"Failed to load data: {e}")
         return pd.DataFrame()
 
-def preprocess_logs(df):
+def expand_log_paths(paths):
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    expanded = []
+    for path in map(str, paths):
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                expanded.extend(os.path.join(root, name) for name in files
+                                if name.endswith(LOG_FILE_SUFFIXES))
+        elif glob.has_magic(path):
+            expanded.extend(glob.glob(path, recursive=True))
+        else:
+            expanded.append(path)
+    return sorted(dict.fromkeys(expanded))
+
+def read_log_file(path, columns=LOG_COLUMNS):
+    # Reads only the requested columns that exist in the file
+    try:
+        if path.endswith((".csv", ".csv.gz")):
+            if columns is None:
+                df = pd.read_csv(path)
+            else:
+                df = pd.read_csv(path, usecols=lambda c: c in columns)
+        elif path.endswith((".jsonl", ".jsonl.gz")):
+            df = pd.read_json(path, lines=True)
+        elif path.endswith(".parquet"):
+            try:
+                df = pd.read_parquet(path, columns=columns)
+            except (KeyError, ValueError):
+                df = pd.read_parquet(path)
+        else:
+            logging.warning(f"Skipping {path}: unsupported log file type.")
+            return pd.DataFrame()
+    except Exception as e:
+        logging.error(f"Failed to load data from {path}: {e}")
+        return pd.DataFrame()
+
+    return _select_columns(df, columns)
+
+def _select_columns(df, columns):
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return df
+
+def iter_log_file(path, batch_rows, columns=LOG_COLUMNS):
+    # Streams one file in batch_rows chunks, so only one chunk is in memory.
+    # Parquet streams by row batch when pyarrow is installed and is read
+    # whole (then sliced) otherwise.
+    try:
+        if path.endswith((".csv", ".csv.gz")):
+            usecols = None if columns is None else (lambda c: c in columns)
+            chunks = pd.read_csv(path, usecols=usecols, chunksize=batch_rows)
+        elif path.endswith((".jsonl", ".jsonl.gz")):
+            chunks = pd.read_json(path, lines=True, chunksize=batch_rows)
+        elif path.endswith(".parquet"):
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                df = read_log_file(path, columns)
+                chunks = (df.iloc[start:start + batch_rows] for start in range(0, len(df), batch_rows))
+            else:
+                parquet = pq.ParquetFile(path)
+                names = None if columns is None else [c for c in columns if c in parquet.schema_arrow.names]
+                chunks = (b.to_pandas() for b in parquet.iter_batches(batch_size=batch_rows, columns=names))
+        else:
+            logging.warning(f"Skipping {path}: unsupported log file type.")
+            return
+        for chunk in chunks:
+            if not chunk.empty:
+                yield _select_columns(chunk, columns).reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"Failed to load data from {path}: {e}")
+
+def load_log_batches(paths=LOG_DATA_PATH, columns=LOG_COLUMNS, max_workers=LOADER_MAX_WORKERS,
+                     batch_rows=None):
+    # Yields DataFrames in path order. Without batch_rows, whole files are
+    # parsed across a process pool, one DataFrame per file; at most two files
+    # per worker are in flight. With batch_rows, files are streamed in chunks
+    # of that many rows in this process, so memory is bounded by one chunk
+    # whatever the file sizes (at the cost of parallel parsing).
+    files = expand_log_paths(paths)
+    if not files:
+        logging.warning(f"No log files found for {paths}.")
+        return
+
+    if batch_rows is not None:
+        for path in files:
+            yield from iter_log_file(path, batch_rows, columns)
+        return
+
+    workers = min(max_workers or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        for path in files:
+            df = read_log_file(path, columns)
+            if not df.empty:
+                yield df
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = []
+        for path in files:
+            in_flight.append(executor.submit(read_log_file, path, columns))
+            if len(in_flight) >= 2 * workers:
+                df = in_flight.pop(0).result()
+                if not df.empty:
+                    yield df
+        for future in in_flight:
+            df = future.result()
+            if not df.empty:
+                yield df
+
+def preprocess_logs(df, source=None):
     # Example preprocessing: drop nulls, convert timestamps
     if df.empty:
         logging.warning("Empty DataFrame received for preprocessing.")
         return df
 
-    df = df.dropna()
+    df = df.dropna().copy()
     if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        # source lets repeated batches from the same log reuse its detected format
+        df['timestamp'] = parse_timestamps(df['timestamp'], source=source)
+    if 'source_ip' in df.columns:
+        # Parse addresses once into integer keys (uint32 for all-IPv4 batches,
+        # 128-bit halves otherwise); the string column is kept for display as
+        # a category (one copy per distinct address)
+        for name, column in ip_columns(df['source_ip']).items():
+            df[name] = column
+        df['source_ip'] = df['source_ip'].astype('category')
     logging.info("Preprocessing complete.")
     return df
+
+def load_checkpoint(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.error(f"Failed to read checkpoint {path}: {e}")
+        return {}
+
+def save_checkpoint(path, checkpoint):
+    # Write-then-rename so a crash never leaves a truncated checkpoint behind
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def log_file_id(path):
+    # Identity of a log file for follow checkpoints: its inode plus a hash of
+    # its first two lines (header and first record), so a rotated file is
+    # told apart even when it reuses the inode (copytruncate) or already
+    # outgrew the old offset. None until the first record is complete.
+    try:
+        with open(path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            head = f.readline()
+            head += f.readline()
+    except OSError:
+        return None
+    if head.count(b"\n") < 2:
+        return None
+    return {"inode": inode, "head": hashlib.sha1(head).hexdigest()}
+
+def _is_csv_row(line, n_columns):
+    try:
+        rows = list(csv.reader([line.decode("utf-8")], strict=True))
+    except (csv.Error, UnicodeDecodeError):
+        return False
+    return len(rows) == 1 and len(rows[0]) == n_columns
+
+def _parse_csv_lines(header, lines, index=None):
+    # Malformed lines (ragged rows, stray quotes) are logged and dropped so
+    # one bad line cannot stall the stream; the rest of the batch survives.
+    # index holds one label per line; each row keeps its line's label.
+    kept = np.arange(len(lines))
+    try:
+        df = pd.read_csv(io.BytesIO(header + b"\n" + b"\n".join(lines)))
+        if len(df) != len(lines):
+            raise ValueError("rows do not line up with input lines")
+    except (pd.errors.ParserError, ValueError, UnicodeDecodeError):
+        # Keep only lines that are well-formed rows on their own, so every
+        # row can be traced back to its line
+        n_columns = len(next(csv.reader([header.decode("utf-8", "replace")])))
+        kept = np.array([i for i, line in enumerate(lines) if _is_csv_row(line, n_columns)], dtype=np.intp)
+        good = [lines[i] for i in kept]
+        df = pd.read_csv(io.BytesIO(header + b"\n" + b"\n".join(good))) if good else pd.DataFrame()
+    if len(df) < len(lines):
+        logging.warning(f"Skipped {len(lines) - len(df)} malformed log lines.")
+    if index is not None:
+        df.index = pd.Index(np.asarray(index)[kept])
+    return df
+
+def follow_log_data(path=LOG_DATA_PATH, offset=0, file_id=None, batch_rows=FOLLOW_BATCH_ROWS,
+                    batch_seconds=FOLLOW_BATCH_SECONDS, poll_seconds=FOLLOW_POLL_SECONDS,
+                    stop_when_idle=False):
+    # Tails a growing CSV and yields (DataFrame, offset, file_id) micro-batches,
+    # where offset is the byte position just past the batch's last line and
+    # file_id is log_file_id() of the file it was read from. Only whole lines
+    # are ever yielded, so the offset is always a safe resume point. Passing
+    # a checkpoint's file_id back in discards its offset if the file changed.
+    # Each row is indexed by the byte offset its line starts at, which stays
+    # the same across restarts and skipped malformed lines.
+    header = None
+    inode = None
+    read_pos = offset
+    partial = b""
+    pending = []  # (line, end offset) of complete lines not yet yielded
+    pending_since = None
+
+    def flush(count):
+        nonlocal pending, pending_since, file_id
+        lines, pending = pending[:count], pending[count:]
+        pending_since = time.monotonic() if pending else None
+        if file_id is None:
+            file_id = log_file_id(path)
+        starts = [end - len(line) - 1 for line, end in lines]
+        return _parse_csv_lines(header, [line for line, _ in lines], starts), lines[-1][1], file_id
+
+    while True:
+        got_data = False
+        try:
+            stat = os.stat(path)
+            size = stat.st_size
+        except OSError:
+            size = None
+
+        if size is not None and header is None:
+            with open(path, "rb") as f:
+                first = f.readline()
+            if first.endswith(b"\n"):
+                header = first.rstrip(b"\r\n")
+                inode = stat.st_ino
+                if read_pos > len(first) and file_id is not None and log_file_id(path) != file_id:
+                    logging.warning(f"{path} is not the file the checkpoint was taken on, "
+                                    f"reading it from the top.")
+                    read_pos, file_id = 0, None
+                read_pos = max(read_pos, len(first))
+
+        if header is not None and size is not None:
+            if size < read_pos or stat.st_ino != inode:
+                logging.warning(f"{path} was truncated or rotated, restarting from the top.")
+                header, read_pos, partial, pending, pending_since = None, 0, b"", [], None
+                file_id = None
+                continue
+
+            if size > read_pos:
+                with open(path, "rb") as f:
+                    f.seek(read_pos)
+                    data = f.read(min(size - read_pos, FOLLOW_READ_BYTES))
+                got_data = bool(data)
+                position = read_pos - len(partial)
+                read_pos += len(data)
+                lines = (partial + data).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    position += len(line) + 1
+                    if line.strip():
+                        pending.append((line, position))
+                if pending and pending_since is None:
+                    pending_since = time.monotonic()
+
+        while len(pending) >= batch_rows:
+            yield flush(batch_rows)
+        if pending and (time.monotonic() - pending_since >= batch_seconds
+                        or (stop_when_idle and not got_data)):
+            yield flush(len(pending))
+
+        if not got_data:
+            if stop_when_idle:
+                return
+            time.sleep(poll_seconds)
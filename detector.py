@@ -1,23 +1,277 @@
 # detector.py
 
+import atexit
 import logging
-from model import load_model
-from config import LOG_LEVEL
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from ip_utils import in_networks, ip_keys, has_ip_keys
+from model import get_cached_model
+from config import (
+    ANOMALY_THRESHOLD, DETECT_MODEL_PATH, DETECT_WORKERS, DETECT_SHARD_ROWS,
+    DETECT_DEDUP, DETECT_CASCADE, CASCADE_RULES, CASCADE_BUSINESS_HOURS,
+    CASCADE_KNOWN_GOOD_NETWORKS, LOG_LEVEL,
+)
 
 logging.basicConfig(level=LOG_LEVEL)
 
-def detect_threats(features):
-    if features.empty:
+SCORE_KINDS = ("anomaly", "score_samples", "decision_function")
+
+# Shard pool reused across calls in this process: (pool, workers, model path).
+# Request threads share it, so it is only checked and replaced under the lock.
+_pool = None
+_pool_lock = threading.Lock()
+_worker_model_path = None
+
+# Rows seen vs rows actually scored by the dedup stage, plus per-stage row
+# counts and wall time for detect_threats (cascade rules, then the model)
+_detection_stats = {
+    "calls": 0, "rows": 0, "scored_rows": 0,
+    "cascade_rows": 0, "cascade_cleared": 0, "cascade_seconds": 0.0,
+    "model_rows": 0, "model_seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+def _init_worker(model_path):
+    # Each worker loads the model once through its own model cache, so shards
+    # carry only feature rows and never a pickled model.
+    global _worker_model_path
+    _worker_model_path = model_path
+    get_cached_model(model_path)
+
+def _model_output(model, features, kind):
+    if kind == "predict":
+        return np.asarray(model.predict(features))
+    if kind == "decision_function":
+        return np.asarray(model.decision_function(features), dtype=np.float64)
+    scores = np.asarray(model.score_samples(features), dtype=np.float64)
+    return -scores if kind == "anomaly" else scores
+
+def _take_rows(features, rows):
+    # Row selection for feature DataFrames and scipy.sparse matrices alike
+    return features.iloc[rows] if hasattr(features, "iloc") else features[rows]
+
+def _score_shard(shard, kind):
+    return _model_output(get_cached_model(_worker_model_path), shard, kind)
+
+def _pool_context():
+    # Workers start from a clean interpreter instead of forking a process
+    # that may already run threads (Flask request threads, alert worker)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def _get_pool(workers, model_path):
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[1:] != (workers, model_path):
+            _pool[0].shutdown()
+            _pool = None
+        if _pool is None:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(),
+                                           initializer=_init_worker, initargs=(model_path,))
+            _pool = (executor, workers, model_path)
+        return _pool[0]
+
+def _shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool[0].shutdown()
+            _pool = None
+
+atexit.register(_shutdown_pool)
+
+def _sharded_output(features, kind, n_workers, shard_rows, model_path=DETECT_MODEL_PATH):
+    # executor.map keeps shard order, so concatenated results line up with
+    # the global row positions of the input frame.
+    n_rows = features.shape[0]
+    shards = [_take_rows(features, slice(start, start + shard_rows)) for start in range(0, n_rows, shard_rows)]
+    pool = _get_pool(n_workers, model_path)
+    return np.concatenate(list(pool.map(_score_shard, shards, repeat(kind))))
+
+def _sparse_row_hashes(features):
+    # Sum of per-entry (column, value) hashes over each CSR row, mixed with the
+    # row's entry count; uint64 arithmetic wraps, which is fine for hashing
+    X = features.tocsr(copy=True)
+    X.sum_duplicates()
+    entries = (pd.util.hash_array(X.indices.astype(np.int64)) * np.uint64(0x9E3779B97F4A7C15)
+               ^ pd.util.hash_array(X.data.astype(np.float64)))
+    prefix = np.concatenate([[np.uint64(0)], np.cumsum(entries, dtype=np.uint64)])
+    nnz = np.diff(X.indptr).astype(np.uint64)
+    return pd.Series((prefix[X.indptr[1:]] - prefix[X.indptr[:-1]]) ^ pd.util.hash_array(nnz))
+
+def _distinct_rows(features):
+    # 64-bit row hashes; factorize numbers them in order of first appearance,
+    # which is also the order of the rows kept by ~duplicated()
+    if hasattr(features, "tocsr"):
+        hashes = _sparse_row_hashes(features)
+    else:
+        hashes = pd.util.hash_pandas_object(features, index=False)
+    codes, _ = pd.factorize(hashes)
+    return _take_rows(features, ~hashes.duplicated().to_numpy()), codes
+
+def _record_stats(**counts):
+    with _stats_lock:
+        for key, value in counts.items():
+            _detection_stats[key] += value
+
+def get_detection_stats():
+    with _stats_lock:
+        stats = dict(_detection_stats)
+    stats["collapse_ratio"] = stats["rows"] / stats["scored_rows"] if stats["scored_rows"] else 1.0
+    # Fraction of rows the cascade rules passed on to the model
+    stats["cascade_pass_rate"] = (
+        1.0 - stats["cascade_cleared"] / stats["cascade_rows"] if stats["cascade_rows"] else 1.0
+    )
+    return stats
+
+def reset_detection_stats():
+    with _stats_lock:
+        for key in _detection_stats:
+            _detection_stats[key] = 0
+
+def _run_model(model, features, kind, n_workers, shard_rows, model_path=DETECT_MODEL_PATH,
+               dedup=False):
+    if dedup:
+        distinct, codes = _distinct_rows(features)
+        _record_stats(calls=1, rows=features.shape[0], scored_rows=distinct.shape[0])
+        logging.debug(f"Dedup collapsed {features.shape[0]} rows to {distinct.shape[0]}.")
+        output = _run_model(model, distinct, kind, n_workers, shard_rows, model_path)
+        return output[codes]
+    if n_workers and n_workers > 1 and features.shape[0] > shard_rows:
+        return _sharded_output(features, kind, n_workers, shard_rows, model_path)
+    return _model_output(model, features, kind)
+
+def score_threats(features, kind="anomaly", model=None, n_workers=DETECT_WORKERS,
+                  shard_rows=DETECT_SHARD_ROWS, model_path=DETECT_MODEL_PATH,
+                  dedup=DETECT_DEDUP):
+    # kind="anomaly" returns the Isolation Forest paper score in (0, 1],
+    # higher = more anomalous; this is the scale ANOMALY_THRESHOLD uses.
+    # The other kinds return sklearn's raw outputs (lower = more anomalous).
+    if kind not in SCORE_KINDS:
+        raise ValueError(f"Unknown score kind: {kind}")
+    if min(features.shape) == 0:
+        logging.warning("Empty feature set received for scoring.")
+        return np.empty(0, dtype=np.float64)
+
+    if model is not None:
+        # An in-memory model is not what the shard workers load from disk
+        return _run_model(model, features, kind, None, shard_rows, dedup=dedup)
+    model = get_cached_model(model_path)
+    if model is None:
+        logging.error("No model available for scoring.")
+        return np.empty(0, dtype=np.float64)
+    return _run_model(model, features, kind, n_workers, shard_rows, model_path, dedup)
+
+def select_threats(anomaly_scores, threshold=ANOMALY_THRESHOLD, top_k=None):
+    # Threshold mode returns indices in input order; top-k mode returns them
+    # ranked from most to least anomalous.
+    scores = np.asarray(anomaly_scores, dtype=np.float64)
+    if threshold is not None:
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(scores.size)
+
+    if top_k is None:
+        return candidates
+    if top_k <= 0 or candidates.size == 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidate_scores = scores[candidates]
+    if top_k < candidates.size:
+        # argpartition is O(n); only the k survivors get fully sorted
+        part = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+    else:
+        part = np.arange(candidates.size)
+    order = part[np.argsort(-candidate_scores[part], kind="stable")]
+    return candidates[order]
+
+def _no_keywords(features, logs):
+    if 'suspicious_flag' not in getattr(features, 'columns', ()):
+        return None
+    return features['suspicious_flag'].to_numpy() == 0
+
+def _business_hours(features, logs):
+    if 'hour' not in getattr(features, 'columns', ()):
+        return None
+    start, end = CASCADE_BUSINESS_HOURS
+    hour = features['hour'].to_numpy()
+    return (hour >= start) & (hour < end)
+
+def _known_good_source(features, logs):
+    if logs is None or not has_ip_keys(logs):
+        return None
+    return in_networks(*ip_keys(logs), CASCADE_KNOWN_GOOD_NETWORKS)
+
+CASCADE_RULE_FUNCS = {
+    "no_keywords": _no_keywords,
+    "business_hours": _business_hours,
+    "known_good_source": _known_good_source,
+}
+
+def cascade_prefilter(features, logs=None, rules=CASCADE_RULES):
+    # Mask of rows every benign rule clears. logs are the preprocessed rows
+    # the features came from (same order). A rule that cannot be evaluated
+    # (e.g. on a sparse model matrix) clears nothing, so those rows still go
+    # to the model.
+    cleared = np.ones(features.shape[0], dtype=bool)
+    for rule in rules:
+        if rule not in CASCADE_RULE_FUNCS:
+            raise ValueError(f"Unknown cascade rule: {rule}")
+        passed = CASCADE_RULE_FUNCS[rule](features, logs)
+        if passed is None:
+            logging.debug(f"Cascade rule {rule} skipped: input columns missing.")
+            return np.zeros(features.shape[0], dtype=bool)
+        cleared &= passed
+    return cleared
+
+def detect_threats(features, threshold=ANOMALY_THRESHOLD, top_k=None, n_workers=DETECT_WORKERS,
+                   shard_rows=DETECT_SHARD_ROWS, model_path=DETECT_MODEL_PATH,
+                   dedup=DETECT_DEDUP, cascade=DETECT_CASCADE, logs=None, as_array=False):
+    # Rows whose anomaly score reaches threshold (ANOMALY_THRESHOLD by default);
+    # with top_k, at most the k highest of those, ranked. threshold=None drops
+    # the cut: with top_k the k highest-scoring rows overall, without it the
+    # model's own predict() labels (its contamination offset).
+    # Returns row positions as a list, or as an int64 ndarray with as_array=True
+    # (no per-index Python ints; see index_codec.py for compact serialization)
+    empty = np.empty(0, dtype=np.int64) if as_array else []
+    if min(features.shape) == 0:
         logging.warning("Empty feature set received for detection.")
-        return []
+        return empty
 
-    model = load_model()
+    model = get_cached_model(model_path)
     if model is None:
         logging.error("No model available for detection.")
-        return []
+        return empty
+
+    # Stage 1: cheap rules clear obvious benign rows; indices of the rest are
+    # kept so model results map back to positions in the full frame
+    n_rows = features.shape[0]
+    candidates = np.arange(n_rows)
+    if cascade:
+        started = time.perf_counter()
+        candidates = np.flatnonzero(~cascade_prefilter(features, logs))
+        _record_stats(cascade_rows=n_rows, cascade_cleared=n_rows - len(candidates),
+                      cascade_seconds=time.perf_counter() - started)
+        features = _take_rows(features, candidates)
+
+    # Stage 2: the model scores whatever the rules did not clear
+    started = time.perf_counter()
+    if features.shape[0] == 0:
+        threat_indices = np.empty(0, dtype=np.intp)
+    elif threshold is None and top_k is None:
+        predictions = _run_model(model, features, "predict", n_workers, shard_rows, model_path, dedup)
+        # IsolationForest: -1 = anomaly, 1 = normal
+        threat_indices = candidates[np.flatnonzero(predictions == -1)]
+    else:
+        scores = _run_model(model, features, "anomaly", n_workers, shard_rows, model_path, dedup)
+        threat_indices = candidates[select_threats(scores, threshold=threshold, top_k=top_k)]
+    _record_stats(model_rows=features.shape[0], model_seconds=time.perf_counter() - started)
 
-    predictions = model.predict(features)
-    # IsolationForest: -1 = anomaly, 1 = normal
-    threat_indices = [i for i, pred in enumerate(predictions) if pred == -1]
     logging.info(f"Detected {len(threat_indices)} potential threats.")
-    return threat_indices
+    return threat_indices.astype(np.int64) if as_array else threat_indices.tolist()
@@ -1,17 +1,86 @@
 # dashboard.py
 
 from flask import Flask, render_template, request
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 from data_loader import preprocess_logs
-from feature_engineering import extract_features
+from feature_engineering import extract_features, build_model_input
 from detector import detect_threats
+from config import (
+    DASHBOARD_MAX_POINTS, DASHBOARD_GRID_BINS, DASHBOARD_NORMAL_SAMPLE,
+    DASHBOARD_MAX_LISTED_INDICES, RANDOM_SEED,
+)
 
 app = Flask(__name__)
 
+def label_threats(df, threat_indices):
+    # Threat indices are positions, so label by position rather than index label
+    threat = np.zeros(len(df), dtype=np.int8)
+    threat[np.asarray(threat_indices, dtype=np.intp)] = 1
+    df["threat"] = threat
+    return df
+
+def build_density_figure(df):
+    # Server-side aggregation: a fixed-size density grid of all rows, every
+    # threat (duplicates collapsed into one marker with a count) and a fixed
+    # sample of normal rows, so the HTML size does not grow with the input.
+    counts, hour_edges, freq_edges = np.histogram2d(
+        df["hour"], df["ip_freq"], bins=[np.arange(25), DASHBOARD_GRID_BINS]
+    )
+    fig = go.Figure(go.Heatmap(
+        z=counts.T,
+        x=hour_edges[:-1],
+        y=(freq_edges[:-1] + freq_edges[1:]) / 2,
+        colorscale="Blues",
+        name="log density",
+    ))
+
+    normal = df[df["threat"] == 0]
+    if len(normal) > DASHBOARD_NORMAL_SAMPLE:
+        normal = normal.sample(n=DASHBOARD_NORMAL_SAMPLE, random_state=RANDOM_SEED)
+    fig.add_trace(go.Scattergl(
+        x=normal["hour"], y=normal["ip_freq"], mode="markers",
+        marker=dict(color="lightgray", size=4), name="normal (sample)",
+    ))
+
+    threats = df[df["threat"] == 1].groupby(["hour", "ip_freq"]).size().reset_index(name="count")
+    fig.add_trace(go.Scattergl(
+        x=threats["hour"], y=threats["ip_freq"], mode="markers",
+        marker=dict(color="red", size=np.clip(4 + np.log2(threats["count"]), 4, 16)),
+        text=threats["count"], hovertemplate="hour %{x}<br>ip_freq %{y}<br>%{text} threats",
+        name="threat",
+    ))
+
+    fig.update_layout(title=f"Threat Detection ({len(df)} rows, aggregated)",
+                      xaxis_title="hour", yaxis_title="ip_freq")
+    return fig
+
+def sample_points(df, max_points=DASHBOARD_MAX_POINTS):
+    # Point-mode cap: threats first, the rest of the budget filled with a
+    # sample of normal rows, so explicit "points" keeps the HTML bounded too
+    if len(df) <= max_points:
+        return df
+    threats = df[df["threat"] == 1]
+    if len(threats) >= max_points:
+        return threats.sample(n=max_points, random_state=RANDOM_SEED)
+    normal = df[df["threat"] == 0].sample(n=max_points - len(threats), random_state=RANDOM_SEED)
+    return pd.concat([threats, normal]).sort_index()
+
+def build_figure(df, mode="auto"):
+    if mode == "density" or (mode == "auto" and len(df) > DASHBOARD_MAX_POINTS):
+        return build_density_figure(df)
+    points = sample_points(df, DASHBOARD_MAX_POINTS)
+    title = "Threat Detection"
+    if len(points) < len(df):
+        title += f" ({len(points)} of {len(df)} rows, sampled)"
+    return px.scatter(points, x="hour", y="ip_freq", color="threat", title=title)
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     threat_indices = []
+    threat_count = 0
     fig_html = None
 
     if request.method == "POST":
@@ -20,16 +89,18 @@ def index():
             df = pd.read_csv(uploaded_file)
             df = preprocess_logs(df)
             features = extract_features(df)
-            threat_indices = detect_threats(features)
+            threat_indices = detect_threats(build_model_input(features, df), logs=df)
+            threat_count = len(threat_indices)
 
-            df["threat"] = 0
-            for i in threat_indices:
-                df.loc[i, "threat"] = 1
+            df = label_threats(df, threat_indices)
+            df["ip_freq"] = features["ip_freq"]
 
-            fig = px.scatter(df, x="hour", y="ip_freq", color="threat", title="Threat Detection")
+            fig = build_figure(df, mode=request.form.get("mode", "auto"))
             fig_html = fig.to_html(full_html=False)
 
-    return render_template("dashboard.html", fig_html=fig_html, threat_indices=threat_indices)
+    return render_template("dashboard.html", fig_html=fig_html,
+                           threat_indices=threat_indices[:DASHBOARD_MAX_LISTED_INDICES],
+                           threat_count=threat_count)
 
 if __name__ == "__main__":
     app.run(debug=True)
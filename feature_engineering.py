@@ -1,31 +1,76 @@
 # feature_engineering.py
 
+import numpy as np
 import pandas as pd
 import logging
-from config import LOG_LEVEL
+from config import (
+    IP_SUBNET_PREFIXES, TEXT_HASH_FEATURES, TEXT_HASH_WIDTH, TEXT_NGRAM_RANGE,
+    LOG_LEVEL,
+)
+from ip_utils import ip_columns, ip_keys, has_ip_keys, group_counts, subnet_keys
+from keyword_matcher import get_keyword_matcher
 
 logging.basicConfig(level=LOG_LEVEL)
 
-def extract_features(df):
+def extract_features(df, ip_counter=None):
     if df.empty:
         logging.warning("Empty DataFrame received for feature extraction.")
         return pd.DataFrame()
 
-    features = pd.DataFrame()
+    features = pd.DataFrame(index=df.index)
 
     # Example: time-based features
     if 'timestamp' in df.columns:
         df['hour'] = df['timestamp'].dt.hour
         features['hour'] = df['hour']
 
-    # Example: frequency of IP addresses
+    # Frequency of IP addresses and their /24 and /16 subnets, counted on the
+    # integer keys preprocess_logs adds (parsed here if it was skipped)
     if 'source_ip' in df.columns:
-        ip_counts = df['source_ip'].value_counts()
-        features['ip_freq'] = df['source_ip'].map(ip_counts)
+        if not has_ip_keys(df):
+            for name, column in ip_columns(df['source_ip']).items():
+                df[name] = column
+        ip_hi, ip_lo = ip_keys(df)
+        features['ip_freq'] = group_counts(ip_hi, ip_lo)
+        for prefix in IP_SUBNET_PREFIXES:
+            features[f'ip_subnet{prefix}_freq'] = group_counts(*subnet_keys(ip_hi, ip_lo, prefix))
 
-    # Example: binary flag for suspicious keywords
+    # Optional: cross-batch sliding-window counts per IP (see streaming_features.py)
+    if ip_counter is not None and {'timestamp', 'source_ip'} <= set(df.columns):
+        window_counts = ip_counter.transform(df['timestamp'], df['source_ip'])
+        for column in window_counts.columns:
+            features[column] = window_counts[column]
+
+    # Keyword family counts from one multi-pattern pass over the messages,
+    # plus a binary flag for any suspicious keyword
     if 'message' in df.columns:
-        features['suspicious_flag'] = df['message'].str.contains("unauthorized|failed|error", case=False, na=False).astype(int)
+        keyword_counts = get_keyword_matcher().features(df['message'])
+        features['suspicious_flag'] = (keyword_counts.sum(axis=1) > 0).astype(int)
+        for column in keyword_counts.columns:
+            features[column] = keyword_counts[column]
 
     logging.info("Feature extraction complete.")
     return features
+
+def extract_text_features(messages, n_features=TEXT_HASH_WIDTH, ngram_range=TEXT_NGRAM_RANGE):
+    # Token n-gram counts hashed into a fixed number of columns, as a sparse
+    # CSR matrix. Each distinct message is vectorized once and its row reused.
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    codes, uniques = pd.factorize(pd.Series(messages, dtype=object).fillna(""))
+    vectorizer = HashingVectorizer(
+        n_features=n_features, ngram_range=ngram_range,
+        alternate_sign=False, norm=None, dtype=np.float32,
+    )
+    return vectorizer.transform(uniques.astype(str))[codes]
+
+def build_model_input(features, df, text_features=TEXT_HASH_FEATURES):
+    # What train_model and detect_threats see: the feature frame as is, or with
+    # hashed message n-grams appended as a CSR matrix (dense columns first)
+    if not text_features or features.empty or 'message' not in df.columns:
+        return features
+    from scipy import sparse
+
+    text = extract_text_features(df['message'])
+    dense = sparse.csr_matrix(features.to_numpy(dtype=np.float32))
+    return sparse.hstack([dense, text], format="csr")
@@ -0,0 +1,101 @@
+# index_codec.py
+
+import base64
+import zlib
+import numpy as np
+
+# JSON-friendly encodings for threat index results. Every payload carries its
+# "encoding" so decode_indices can undo it:
+#   list   - {"indices": [i, ...]}, order preserved (e.g. top-k ranking)
+#   ranges - {"ranges": [[start, stop], ...]}, half-open runs of consecutive
+#            indices; suits bursts of adjacent anomalies
+#   bitmap - {"start": s, "length": n, "data": base64(zlib(packbits))} over
+#            positions s .. s+n-1; suits dense results
+#   auto   - whichever of the three serializes shortest
+# ranges and bitmap describe the set of indices, so they decode sorted.
+ENCODINGS = ("list", "ranges", "bitmap", "auto")
+
+def _as_indices(indices):
+    return np.asarray(indices, dtype=np.int64).ravel()
+
+def _runs(sorted_unique):
+    # Boundaries wherever the next index is not the previous one + 1
+    breaks = np.flatnonzero(np.diff(sorted_unique) != 1) + 1
+    starts = sorted_unique[np.concatenate([[0], breaks])]
+    stops = sorted_unique[np.concatenate([breaks - 1, [sorted_unique.size - 1]])] + 1
+    return starts, stops
+
+def _digits(values):
+    # Characters needed to print each non-negative integer
+    return np.floor(np.log10(np.maximum(values, 1))).astype(np.int64) + 1
+
+def encode_list(indices):
+    return {"encoding": "list", "indices": _as_indices(indices).tolist()}
+
+def encode_ranges(indices):
+    unique = np.unique(_as_indices(indices))
+    if unique.size == 0:
+        return {"encoding": "ranges", "ranges": []}
+    starts, stops = _runs(unique)
+    return {"encoding": "ranges", "ranges": np.column_stack([starts, stops]).tolist()}
+
+def encode_bitmap(indices, length=None, start=None):
+    indices = _as_indices(indices)
+    if start is None:
+        start = int(indices.min()) if indices.size else 0
+    if length is None:
+        length = int(indices.max()) + 1 - start if indices.size else 0
+    if indices.size and (indices.min() < start or indices.max() >= start + length):
+        raise ValueError("indices fall outside the bitmap range")
+    mask = np.zeros(length, dtype=bool)
+    mask[indices - start] = True
+    data = base64.b64encode(zlib.compress(np.packbits(mask).tobytes())).decode("ascii")
+    return {"encoding": "bitmap", "start": int(start), "length": int(length), "data": data}
+
+def encode_indices(indices, encoding="list", length=None, start=None):
+    if encoding == "list":
+        return encode_list(indices)
+    if encoding == "ranges":
+        return encode_ranges(indices)
+    if encoding == "bitmap":
+        return encode_bitmap(indices, length=length, start=start)
+    if encoding == "auto":
+        indices = _as_indices(indices)
+        if indices.size == 0:
+            return encode_list(indices)
+        # Size estimates from digit counts, so the list and ranges forms are
+        # never built just to be measured; the bitmap is small enough to build
+        unique = np.unique(indices)
+        starts, stops = _runs(unique)
+        candidates = {
+            "list": int(_digits(indices).sum()) + 2 * indices.size,
+            "ranges": int(_digits(starts).sum() + _digits(stops).sum()) + 6 * starts.size,
+        }
+        bitmap = encode_bitmap(unique, length=length, start=start)
+        candidates["bitmap"] = len(bitmap["data"]) + 40
+        best = min(candidates, key=candidates.get)
+        if best == "bitmap":
+            return bitmap
+        return encode_list(indices) if best == "list" else encode_ranges(unique)
+    raise ValueError(f"Unknown index encoding: {encoding}")
+
+def decode_indices(payload):
+    # Accepts any encode_indices payload, or a plain JSON list of indices
+    if isinstance(payload, list):
+        return _as_indices(payload)
+    encoding = payload.get("encoding")
+    if encoding == "list":
+        return _as_indices(payload["indices"])
+    if encoding == "ranges":
+        ranges = np.asarray(payload["ranges"], dtype=np.int64).reshape(-1, 2)
+        if ranges.size == 0:
+            return np.empty(0, dtype=np.int64)
+        lengths = ranges[:, 1] - ranges[:, 0]
+        # Each run is start + 0, 1, ..., length-1
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(ranges[:, 0], lengths) + offsets
+    if encoding == "bitmap":
+        packed = np.frombuffer(zlib.decompress(base64.b64decode(payload["data"])), dtype=np.uint8)
+        mask = np.unpackbits(packed, count=payload["length"]).astype(bool)
+        return np.flatnonzero(mask).astype(np.int64) + payload["start"]
+    raise ValueError(f"Unknown index encoding: {encoding}")
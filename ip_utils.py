@@ -0,0 +1,151 @@
+# ip_utils.py
+
+import ipaddress
+import logging
+import numpy as np
+import pandas as pd
+from config import LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Every address is held as a 128-bit (hi, lo) pair of uint64. IPv4 uses the
+# IPv4-mapped IPv6 form ::ffff:a.b.c.d, so hi == 0 and the low 32 bits of lo
+# are the familiar uint32. Unparseable and missing values map to the
+# sentinel key (2**64 - 1, 2**64 - 1), i.e. ffff:...:ffff: a multicast
+# address, which is never a packet source, and not a subnet_keys() result.
+_V4_MAPPED = np.uint64(0xFFFF << 32)
+_LOW32 = np.uint64(0xFFFFFFFF)
+_INVALID = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+def parse_ipv4(values):
+    # Vectorized dotted-quad -> uint32; invalid entries get valid == False
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+    parts = text.str.split(".", n=3, expand=True).reindex(columns=range(4))
+    octets = parts.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    valid = (np.all((octets >= 0) & (octets <= 255) & (octets == np.floor(octets)), axis=1)
+             & ~text.str.contains(r"[^0-9.]", regex=True).to_numpy())
+    octets = np.where(valid[:, None], octets, 0).astype(np.uint32)
+    packed = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    return packed, valid
+
+def parse_ips(values):
+    # Parses each distinct address once: logs repeat a small set of IPs, so
+    # the work is proportional to the number of unique values, not rows.
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    v4, is_v4 = parse_ipv4(uniques)
+    hi = np.zeros(len(uniques), dtype=np.uint64)
+    lo = np.where(is_v4, _V4_MAPPED | v4.astype(np.uint64), np.uint64(0))
+
+    invalid = 0
+    for i in np.flatnonzero(~is_v4):
+        try:
+            address = ipaddress.ip_address(str(uniques[i]).strip())
+        except ValueError:
+            invalid += 1
+            hi[i] = lo[i] = _INVALID
+            continue
+        if address.version == 4:
+            lo[i] = _V4_MAPPED | np.uint64(int(address))
+        else:
+            value = int(address)
+            hi[i], lo[i] = np.uint64(value >> 64), np.uint64(value & 0xFFFFFFFFFFFFFFFF)
+    if invalid:
+        logging.warning(f"{invalid} distinct source IPs could not be parsed.")
+
+    # factorize marks missing values with -1; they also get the sentinel
+    hi = np.append(hi, _INVALID)[codes]
+    lo = np.append(lo, _INVALID)[codes]
+    return hi, lo
+
+def is_valid_ip(hi, lo):
+    # False for the sentinel key of unparseable or missing addresses
+    return ~((np.asarray(hi) == _INVALID) & (np.asarray(lo) == _INVALID))
+
+def is_ipv4(hi, lo):
+    return (np.asarray(hi) == 0) & ((np.asarray(lo) & ~_LOW32) == _V4_MAPPED)
+
+def ipv4_to_uint32(lo):
+    return (np.asarray(lo, dtype=np.uint64) & _LOW32).astype(np.uint32)
+
+def uint32_to_ips(v4):
+    # Inverse of ipv4_to_uint32: uint32 addresses back to (hi, lo) pairs
+    v4 = np.asarray(v4, dtype=np.uint64)
+    return np.zeros(v4.shape, dtype=np.uint64), _V4_MAPPED | v4
+
+def ip_columns(values):
+    # Integer columns stored per row: a single uint32 ip_v4 when the whole
+    # batch is IPv4 (the common case, 4 bytes a row), otherwise the 128-bit
+    # ip_hi / ip_lo pair (16 bytes a row). Read them back with ip_keys().
+    hi, lo = parse_ips(values)
+    if len(lo) and is_ipv4(hi, lo).all():
+        return {"ip_v4": ipv4_to_uint32(lo)}
+    return {"ip_hi": hi, "ip_lo": lo}
+
+def ip_keys(df):
+    # (hi, lo) arrays for a frame holding either form of ip_columns(), or
+    # parsed from source_ip when neither is there
+    if "ip_v4" in df.columns:
+        return uint32_to_ips(df["ip_v4"].to_numpy())
+    if {"ip_hi", "ip_lo"} <= set(df.columns):
+        return df["ip_hi"].to_numpy(np.uint64), df["ip_lo"].to_numpy(np.uint64)
+    return parse_ips(df["source_ip"])
+
+def has_ip_keys(df):
+    return "ip_v4" in df.columns or {"ip_hi", "ip_lo"} <= set(df.columns)
+
+def format_ips(hi, lo):
+    # Inverse of parse_ips, for display and alerts; again once per distinct address
+    pairs = pd.DataFrame({"hi": np.asarray(hi, dtype=np.uint64), "lo": np.asarray(lo, dtype=np.uint64)})
+    codes, uniques = pd.factorize(pd.MultiIndex.from_frame(pairs))
+    text = []
+    for u_hi, u_lo in uniques:
+        address = ipaddress.IPv6Address((int(u_hi) << 64) | int(u_lo))
+        text.append(str(address.ipv4_mapped or address))
+    return np.asarray(text, dtype=object)[codes]
+
+def subnet_keys(hi, lo, prefix_len):
+    # Integer key of the enclosing IPv4 /prefix_len (IPv6 addresses are
+    # grouped by the same number of trailing bits dropped from the 128-bit
+    # form); the invalid-address sentinel stays the sentinel
+    shift = np.uint64(32 - prefix_len)
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    return hi, np.where(is_valid_ip(hi, lo), lo >> shift, _INVALID)
+
+def group_counts(hi, lo):
+    # Rows per distinct (hi, lo) key, broadcast back to every row. Factorizing
+    # the two uint64 halves separately keeps the combined code exact. Rows
+    # with the invalid-address sentinel count 1 each instead of pooling into
+    # one very frequent "address".
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo_codes, lo_uniques = pd.factorize(np.asarray(lo, dtype=np.uint64))
+    if not hi.any():
+        # IPv4-only batches: lo alone is the key (and no sentinel is present)
+        return np.bincount(lo_codes)[lo_codes]
+    hi_codes, _ = pd.factorize(hi)
+    codes, _ = pd.factorize(hi_codes.astype(np.int64) * len(lo_uniques) + lo_codes)
+    counts = np.bincount(codes)[codes]
+    counts[~is_valid_ip(hi, lo)] = 1
+    return counts
+
+def parse_networks(networks):
+    # CIDR strings -> (net_hi, net_lo, mask_hi, mask_lo) arrays in the same
+    # 128-bit space as parse_ips (IPv4 networks sit under ::ffff:0:0/96)
+    rows = []
+    for network in networks:
+        net = ipaddress.ip_network(network, strict=False)
+        if net.version == 4:
+            net = ipaddress.IPv6Network((int(_V4_MAPPED) | int(net.network_address), 96 + net.prefixlen))
+        mask = int(net.netmask)
+        value = int(net.network_address)
+        rows.append((value >> 64, value & 0xFFFFFFFFFFFFFFFF, mask >> 64, mask & 0xFFFFFFFFFFFFFFFF))
+    return np.array(rows, dtype=np.uint64).reshape(-1, 4).T
+
+def in_networks(hi, lo, networks):
+    # True where the address falls inside any of the networks
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    inside = np.zeros(hi.shape, dtype=bool)
+    for net_hi, net_lo, mask_hi, mask_lo in zip(*parse_networks(networks)):
+        inside |= ((hi & mask_hi) == net_hi) & ((lo & mask_lo) == net_lo)
+    return inside
@@ -0,0 +1,142 @@
+# keyword_matcher.py
+
+import logging
+import os
+from collections import deque
+import numpy as np
+import pandas as pd
+import yaml
+from config import KEYWORD_FAMILIES_PATH, DEFAULT_KEYWORD_FAMILIES, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Optional: the C implementation of Aho-Corasick, used when installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+def _resolve_path(path):
+    # Relative paths are taken from the repo root (this module's directory),
+    # not the working directory, so the kw_* schema does not depend on cwd
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def load_keyword_families(path=KEYWORD_FAMILIES_PATH):
+    # path=None means "use DEFAULT_KEYWORD_FAMILIES". A configured file that is
+    # missing or unreadable raises: falling back would silently change the
+    # kw_* feature columns a trained model expects.
+    if not path:
+        return {family: list(words) for family, words in DEFAULT_KEYWORD_FAMILIES.items()}
+    path = _resolve_path(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Keyword file {path} not found.")
+    try:
+        with open(path, "r") as f:
+            families = yaml.safe_load(f) or {}
+        return {str(family): [str(w) for w in words or []] for family, words in families.items()}
+    except Exception as e:
+        logging.error(f"Failed to load keyword families from {path}: {e}")
+        raise
+
+class KeywordMatcher:
+    # Case-insensitive multi-pattern matcher: one automaton over every keyword
+    # of every family, so each message is scanned once no matter how many
+    # keywords there are.
+
+    def __init__(self, families):
+        self.families = list(families)
+        self._keywords = {}
+        for index, family in enumerate(self.families):
+            for word in families[family]:
+                word = word.lower()
+                if word:
+                    self._keywords.setdefault(word, set()).add(index)
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word, indices in self._keywords.items():
+                self._automaton.add_word(word, tuple(sorted(indices)))
+            if self._keywords:
+                self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._build_automaton()
+
+    def _build_automaton(self):
+        # goto[state] maps char -> state, out[state] lists family indices of
+        # every keyword ending at that state (merged along failure links).
+        self._goto = [{}]
+        self._out = [()]
+        for word, indices in self._keywords.items():
+            state = 0
+            for char in word:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._out.append(())
+                state = nxt
+            self._out[state] = self._out[state] + tuple(sorted(indices))
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _scan(self, text, row):
+        if self._automaton is not None:
+            for _, indices in self._automaton.iter(text):
+                for index in indices:
+                    row[index] += 1
+            return row
+
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                row[index] += 1
+        return row
+
+    def count(self, messages):
+        # Returns an (n_messages, n_families) int array of keyword hit counts.
+        # Log messages repeat a lot, so each distinct message is scanned once.
+        messages = pd.Series(messages)
+        codes, uniques = pd.factorize(messages)
+        counts = np.zeros((len(uniques) + 1, len(self.families)), dtype=np.int32)
+        if self._keywords:
+            lowered = pd.Series(uniques, dtype=object).str.lower()
+            empty = [0] * len(self.families)
+            for row, text in enumerate(lowered):
+                if isinstance(text, str):
+                    hits = self._scan(text, list(empty))
+                    if any(hits):
+                        counts[row] = hits
+        # code -1 (missing message) maps to the trailing all-zero row
+        return counts[np.where(codes < 0, len(uniques), codes)]
+
+    def features(self, messages):
+        counts = self.count(messages)
+        index = getattr(messages, "index", None)
+        return pd.DataFrame(counts, columns=[f"kw_{family}" for family in self.families], index=index)
+
+_default_matcher = None
+
+def get_keyword_matcher():
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = KeywordMatcher(load_keyword_families())
+    return _default_matcher
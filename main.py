@@ -1,30 +1,129 @@
 # main.py
 
-from data_loader import load_log_data, preprocess_logs
-from feature_engineering import extract_features
+import argparse
+import logging
+import pandas as pd
+from data_loader import (
+    load_log_data, preprocess_logs, follow_log_data, load_checkpoint,
+    save_checkpoint,
+)
+from feature_engineering import extract_features, build_model_input
+from streaming_features import IPWindowCounter
 from detector import detect_threats
-from alert import send_console_alert, send_webhook_alert
-from model import train_model, save_model
+from alert import send_console_alert, dispatch_webhook_alert
+from result_store import get_result_store
+from training_sample import build_training_sample
+from model import train_model, refresh_model, save_model, load_model, get_cached_model
+from config import (
+    LOG_DATA_PATH, FOLLOW_CHECKPOINT_PATH, FOLLOW_MIN_TRAIN_ROWS, FOLLOW_IP_WINDOW_COUNTS,
+    MODEL_INCREMENTAL_REFRESH, COMPACT_MODEL_PATH,
+)
 
-def run_pipeline():
+def run_pipeline(incremental=MODEL_INCREMENTAL_REFRESH):
     # Step 1: Load and preprocess logs
     raw_logs = load_log_data()
     clean_logs = preprocess_logs(raw_logs)
 
     # Step 2: Extract features
-    features = extract_features(clean_logs)
+    features = build_model_input(extract_features(clean_logs), clean_logs)
 
-    # Step 3: Train model (optional — can be skipped if model already trained)
-    model = train_model(features)
+    # Step 3: Train model (optional — can be skipped if model already trained).
+    # Incremental mode refreshes the saved forest instead of a full retrain.
+    if incremental:
+        model = refresh_model(load_model(), features)
+    else:
+        model = train_model(features)
     if model:
         save_model(model)
+        # Flattened copy for sklearn-free scoring (DETECT_MODEL_PATH)
+        save_model(model, COMPACT_MODEL_PATH)
 
     # Step 4: Detect threats
-    threat_indices = detect_threats(features)
+    threat_indices = detect_threats(features, logs=clean_logs)
 
-    # Step 5: Send alerts
+    # Step 5: Record flagged rows for later time-range / per-IP queries. Each
+    # run rescores the whole log, so its parts replace the previous run's.
+    get_result_store().write(clean_logs, threat_indices, key=LOG_DATA_PATH)
+
+    # Step 6: Send alerts
     send_console_alert(threat_indices)
-    send_webhook_alert(threat_indices)
+    dispatch_webhook_alert(threat_indices, key=LOG_DATA_PATH)
+
+def run_training(path=LOG_DATA_PATH):
+    # Trains from a bounded reservoir sample of every log under path instead
+    # of loading all of it, then saves the model for detection runs
+    model = train_model(build_training_sample(path))
+    if model:
+        save_model(model)
+        save_model(model, COMPACT_MODEL_PATH)
+    return model
+
+def run_follow(path=LOG_DATA_PATH, checkpoint_path=FOLLOW_CHECKPOINT_PATH, stop_when_idle=False,
+               min_train_rows=FOLLOW_MIN_TRAIN_ROWS, ip_window_counts=FOLLOW_IP_WINDOW_COUNTS):
+    # Resume from the saved byte offset instead of rescanning the whole file
+    # (the file_id check makes a rotated file start over from its top)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint.get("path") != path:
+        checkpoint = {}
+    offset = checkpoint.get("offset", 0)
+    logging.info(f"Following {path} from byte offset {offset}.")
+    warmup = []  # preprocessed rows held back until the first model is trained
+
+    # Window counts span batches and restarts: the counter is saved with the
+    # checkpoint, so it always covers exactly the rows before the offset
+    ip_counter = None
+    if ip_window_counts:
+        state = checkpoint.get("ip_counts")
+        ip_counter = IPWindowCounter.restore(state) if state else IPWindowCounter()
+
+    for batch, offset, file_id in follow_log_data(path, offset=offset, file_id=checkpoint.get("file_id"),
+                                                  stop_when_idle=stop_when_idle):
+        clean_logs = preprocess_logs(batch, source=path)
+
+        # Follow mode scores with the saved model; it only trains when none
+        # exists yet, and then on at least min_train_rows rows
+        untrained = get_cached_model() is None
+        if untrained:
+            warmup.append(clean_logs)
+            clean_logs = pd.concat(warmup)
+            if len(clean_logs) < min_train_rows:
+                # The checkpoint stays put, so a restart reads these rows again
+                logging.info(f"No model yet: {len(clean_logs)} of {min_train_rows} rows for training.")
+                continue
+            warmup = []
+        features = build_model_input(extract_features(clean_logs, ip_counter=ip_counter), clean_logs)
+        if untrained:
+            model = train_model(features)
+            if model:
+                save_model(model)
+                save_model(model, COMPACT_MODEL_PATH)
+
+        # Detector positions -> byte offsets of the rows' lines in the followed
+        # file, so alerts from successive batches (and restarts) share one
+        # stable key and can be coalesced
+        threat_indices = detect_threats(features, logs=clean_logs, as_array=True)
+        threat_rows = clean_logs.index.to_numpy()[threat_indices].tolist()
+        send_console_alert(threat_rows)
+        dispatch_webhook_alert(threat_rows, key=path)
+
+        checkpoint = {"path": path, "offset": offset, "file_id": file_id}
+        if ip_counter is not None:
+            checkpoint["ip_counts"] = ip_counter.snapshot()
+        save_checkpoint(checkpoint_path, checkpoint)
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description="Threat detection pipeline")
+    parser.add_argument("--follow", action="store_true",
+                        help="tail LOG_DATA_PATH in micro-batches instead of a one-shot run")
+    parser.add_argument("--refresh", action="store_true",
+                        help="refresh the saved model incrementally instead of retraining it")
+    parser.add_argument("--train-sample", action="store_true",
+                        help="only train, from a reservoir sample of all logs (bounded memory)")
+    args = parser.parse_args()
+
+    if args.follow:
+        run_follow()
+    elif args.train_sample:
+        run_training()
+    else:
+        run_pipeline(incremental=args.refresh or MODEL_INCREMENTAL_REFRESH)
@@ -1,34 +1,152 @@
 # model.py
 
 import logging
-import joblib
-from sklearn.ensemble import IsolationForest
-from config import MODEL_PATH, RANDOM_SEED, LOG_LEVEL
+import os
+import threading
+import numpy as np
+from compact_model import CompactForest
+from config import (
+    MODEL_PATH, RANDOM_SEED, LOG_LEVEL, MODEL_N_ESTIMATORS, MODEL_MAX_SAMPLES,
+    MODEL_N_JOBS, MODEL_CONTAMINATION, MODEL_REFRESH_TREES,
+)
 
 logging.basicConfig(level=LOG_LEVEL)
 
+# Artifacts with this suffix are flattened forests (compact_model.py); loading
+# one needs only numpy, so sklearn and joblib are imported lazily below.
+COMPACT_SUFFIX = ".npz"
+
+# Process-wide model cache: path -> ((st_mtime_ns, st_size), model)
+_model_cache = {}
+_cache_stats = {"hits": 0, "misses": 0, "reloads": 0}
+_cache_lock = threading.Lock()
+
 def train_model(X):
-    if X.empty:
+    # X is a feature DataFrame or a scipy.sparse matrix (sklearn keeps it sparse)
+    if min(X.shape) == 0:
         logging.warning("Empty feature set received for training.")
         return None
 
-    model = IsolationForest(random_state=RANDOM_SEED, contamination=0.1)
+    from sklearn.ensemble import IsolationForest
+    model = IsolationForest(
+        n_estimators=MODEL_N_ESTIMATORS,
+        max_samples=MODEL_MAX_SAMPLES,
+        n_jobs=MODEL_N_JOBS,
+        random_state=RANDOM_SEED,
+        contamination=MODEL_CONTAMINATION,
+    )
     model.fit(X)
     logging.info("Model training complete.")
     return model
 
+def refresh_model(model, X, n_new_trees=MODEL_REFRESH_TREES):
+    # Warm-start refresh: fit n_new_trees on the recent data, then retire the
+    # same number of oldest trees so the forest keeps a constant size.
+    if min(X.shape) == 0:
+        logging.warning("Empty feature set received for refresh.")
+        return model
+    if model is None:
+        return train_model(X)
+    columns = list(getattr(X, "columns", range(X.shape[1])))
+    if model.n_features_in_ != X.shape[1] or list(getattr(model, "feature_names_in_", columns)) != columns:
+        logging.warning("Feature set changed since the model was trained, retraining.")
+        return train_model(X)
+
+    n_trees = len(model.estimators_)
+    # With a fixed random_state and a constant forest size, a warm fit would
+    # draw the same per-tree seeds (and sample indices) on every refresh.
+    # Each refresh gets its own seed from a generation counter on the model;
+    # random_state is put back afterwards so the next refresh derives from it.
+    base_seed = model.random_state
+    generation = getattr(model, "refresh_generation_", 0) + 1
+    refresh_seed = int(np.random.SeedSequence([RANDOM_SEED if base_seed is None else base_seed,
+                                               generation]).generate_state(1)[0])
+    model.set_params(warm_start=True, n_estimators=n_trees + n_new_trees, n_jobs=MODEL_N_JOBS,
+                     random_state=refresh_seed)
+    model.fit(X)
+    model.refresh_generation_ = generation
+
+    retired = min(n_new_trees, n_trees)
+    del model.estimators_[:retired]
+    del model.estimators_features_[:retired]
+    # Per-tree caches sklearn keeps alongside estimators_ for scoring
+    for attr in ("_average_path_length_per_tree", "_decision_path_lengths"):
+        if hasattr(model, attr):
+            setattr(model, attr, getattr(model, attr)[retired:])
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_), random_state=base_seed)
+
+    # The contamination offset has to reflect the refreshed forest
+    if model.contamination != "auto":
+        model.offset_ = np.percentile(model.score_samples(X), 100.0 * model.contamination)
+
+    logging.info(f"Model refreshed: {n_new_trees} trees added, {retired} retired.")
+    return model
+
 def save_model(model, path=MODEL_PATH):
+    # Dump next to the target and rename, so readers never see a partial file
+    tmp_path = f"{path}.tmp"
     try:
-        joblib.dump(model, path)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith(COMPACT_SUFFIX):
+            if not isinstance(model, CompactForest):
+                model = CompactForest.from_sklearn(model)
+            model.save(path)
+        else:
+            import joblib
+            joblib.dump(model, tmp_path)
+            os.replace(tmp_path, path)
         logging.info(f"Model saved to {path}")
     except Exception as e:
         logging.error(f"Failed to save model: {e}")
 
 def load_model(path=MODEL_PATH):
     try:
-        model = joblib.load(path)
+        if path.endswith(COMPACT_SUFFIX):
+            model = CompactForest.load(path)
+        else:
+            import joblib
+            model = joblib.load(path)
         logging.info(f"Model loaded from {path}")
         return model
     except Exception as e:
         logging.error(f"Failed to load model: {e}")
         return None
+
+def get_cached_model(path=MODEL_PATH):
+    # A stat() call is much cheaper than unpickling, so only reload when the
+    # artifact's mtime or size has changed since it was cached.
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logging.error(f"Failed to load model: {e}")
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _model_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _cache_stats["hits"] += 1
+            return cached[1]
+
+        model = load_model(path)
+        if model is None:
+            return None
+        if cached is None:
+            _cache_stats["misses"] += 1
+        else:
+            _cache_stats["reloads"] += 1
+            logging.info(f"Model artifact at {path} changed, reloaded.")
+        _model_cache[path] = (signature, model)
+        return model
+
+def get_model_cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats, cached_models=len(_model_cache))
+
+def clear_model_cache():
+    with _cache_lock:
+        _model_cache.clear()
+        for key in _cache_stats:
+            _cache_stats[key] = 0
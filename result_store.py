@@ -0,0 +1,207 @@
+# result_store.py
+
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from ip_utils import parse_ips, format_ips, ip_keys, has_ip_keys
+from config import RESULT_STORE_PATH, RESULT_STORE_CACHE_PARTS, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+_NS_PER_HOUR = 3600 * 10 ** 9
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+def _epoch_ns(timestamps):
+    # Naive timestamps are stored as is, tz-aware ones as UTC wall time
+    ts = pd.Series(timestamps)
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = pd.to_datetime(ts)
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        ts = ts.dt.tz_convert("UTC").dt.tz_localize(None)
+    valid = ts.notna().to_numpy()
+    return ts.to_numpy(dtype="datetime64[ns]").astype(np.int64), valid
+
+def _bound_ns(value):
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert("UTC").tz_localize(None)
+    return value.value
+
+def _ip_slice(ip_hi, ip_lo, hi, lo):
+    # Rows are sorted by (ip_hi, ip_lo): two binary searches on each half
+    a = np.searchsorted(ip_hi, hi, side="left")
+    b = np.searchsorted(ip_hi, hi, side="right")
+    return slice(a + np.searchsorted(ip_lo[a:b], lo, side="left"),
+                 a + np.searchsorted(ip_lo[a:b], lo, side="right"))
+
+class ResultStore:
+    # Flagged detections on disk, one directory per day (day=YYYY-MM-DD) and
+    # one npz part per write. Each part holds the flagged rows as columns
+    # sorted by source IP, so per-IP lookups are binary searches, plus hourly
+    # rollups (rows seen / rows flagged) of everything that was scored.
+    # Writes with a key replace that key's earlier parts, so rescoring the
+    # same source does not double-count. Queries only open the days their
+    # time range covers.
+
+    def __init__(self, root=RESULT_STORE_PATH, cache_parts=RESULT_STORE_CACHE_PARTS):
+        self.root = root
+        self.cache_parts = cache_parts
+        # LRU of loaded parts: path -> ((st_mtime_ns, st_size), columns)
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _day_dir(self, day_ns):
+        day = np.datetime64(int(day_ns), "ns").astype("datetime64[D]")
+        return os.path.join(self.root, f"day={day}")
+
+    def write(self, logs, threat_indices, key=None):
+        # logs: preprocessed rows (timestamp, IP keys); threat_indices:
+        # positions in logs flagged by detect_threats. key names what the
+        # rows are a complete scoring of (e.g. the source path): its previous
+        # parts are replaced. Without a key every write adds new parts.
+        # Returns rows stored.
+        if logs.empty:
+            return 0
+        if "timestamp" not in logs.columns or not (has_ip_keys(logs) or "source_ip" in logs.columns):
+            logging.warning("Logs have no timestamp or source IP, nothing stored.")
+            return 0
+        ts, valid = _epoch_ns(logs["timestamp"])
+        ip_hi, ip_lo = ip_keys(logs)
+        flagged = np.zeros(len(logs), dtype=bool)
+        flagged[np.asarray(threat_indices, dtype=np.int64)] = True
+        if not valid.all():
+            logging.warning(f"{int((~valid).sum())} rows without a timestamp not stored.")
+
+        rows = np.flatnonzero(valid)
+        days = ts[rows] // _NS_PER_DAY
+        if key is None:
+            part_name = f"part-{time.time_ns()}-{os.getpid()}.npz"
+        else:
+            part_name = f"part-{hashlib.sha1(str(key).encode()).hexdigest()[:16]}.npz"
+        written = set()
+        stored = 0
+        for day in np.unique(days):
+            day_rows = rows[days == day]
+            written.add(self._day_dir(day * _NS_PER_DAY))
+            hours = ts[day_rows] // _NS_PER_HOUR
+            rollup_hour, inverse = np.unique(hours, return_inverse=True)
+            hits = day_rows[flagged[day_rows]]
+            order = np.lexsort((ts[hits], ip_lo[hits], ip_hi[hits]))
+            hits = hits[order]
+            self._write_part(os.path.join(self._day_dir(day * _NS_PER_DAY), part_name), {
+                "timestamp": ts[hits],
+                "ip_hi": ip_hi[hits],
+                "ip_lo": ip_lo[hits],
+                "row": hits.astype(np.int64),
+                "rollup_hour": rollup_hour * _NS_PER_HOUR,
+                "rollup_rows": np.bincount(inverse, minlength=len(rollup_hour)),
+                "rollup_threats": np.bincount(inverse, weights=flagged[day_rows],
+                                              minlength=len(rollup_hour)).astype(np.int64),
+            })
+            stored += len(hits)
+        if key is not None:
+            # Days the earlier write covered but this one does not
+            for path in glob.glob(os.path.join(self.root, "day=*", part_name)):
+                if os.path.dirname(path) not in written:
+                    os.remove(path)
+        logging.info(f"Stored {stored} flagged rows in {self.root}")
+        return stored
+
+    def _write_part(self, path, columns):
+        # Same tmp-file + rename pattern as model.save_model
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **columns)
+        os.replace(tmp_path, path)
+
+    def _load_part(self, path):
+        # Keyed writes replace parts in place, so cached parts are checked
+        # against the file's stat like model.get_cached_model does
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._parts.get(path)
+            if cached is not None and cached[0] == signature:
+                self._parts.move_to_end(path)
+                return cached[1]
+        with np.load(path) as data:
+            part = {name: data[name] for name in data.files}
+        with self._lock:
+            self._parts[path] = (signature, part)
+            self._parts.move_to_end(path)
+            while len(self._parts) > self.cache_parts:
+                self._parts.popitem(last=False)
+        return part
+
+    def _iter_parts(self, start_ns, end_ns):
+        for day_dir in sorted(glob.glob(os.path.join(self.root, "day=*"))):
+            day_ns = pd.Timestamp(os.path.basename(day_dir)[len("day="):]).value
+            if start_ns is not None and day_ns + _NS_PER_DAY <= start_ns:
+                continue
+            if end_ns is not None and day_ns >= end_ns:
+                continue
+            for path in sorted(glob.glob(os.path.join(day_dir, "part-*.npz"))):
+                yield self._load_part(path)
+
+    def query(self, start=None, end=None, source_ip=None):
+        # Flagged rows with start <= timestamp < end, optionally for one IP
+        start_ns, end_ns = _bound_ns(start), _bound_ns(end)
+        if source_ip is not None:
+            hi, lo = (int(v[0]) for v in parse_ips([source_ip]))
+
+        pieces = []
+        for part in self._iter_parts(start_ns, end_ns):
+            span = slice(None)
+            if source_ip is not None:
+                span = _ip_slice(part["ip_hi"], part["ip_lo"], np.uint64(hi), np.uint64(lo))
+            ts = part["timestamp"][span]
+            keep = np.ones(len(ts), dtype=bool)
+            if start_ns is not None:
+                keep &= ts >= start_ns
+            if end_ns is not None:
+                keep &= ts < end_ns
+            pieces.append({name: part[name][span][keep] for name in ("timestamp", "ip_hi", "ip_lo", "row")})
+
+        if not pieces:
+            return pd.DataFrame(columns=["timestamp", "source_ip", "row"])
+        columns = {name: np.concatenate([p[name] for p in pieces]) for name in pieces[0]}
+        result = pd.DataFrame({
+            "timestamp": columns["timestamp"].astype("datetime64[ns]"),
+            "source_ip": format_ips(columns["ip_hi"], columns["ip_lo"]),
+            "row": columns["row"],
+        })
+        return result.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+    def hourly_rollups(self, start=None, end=None):
+        # Rows scored and rows flagged per hour, summed over all writes
+        start_ns, end_ns = _bound_ns(start), _bound_ns(end)
+        frames = [
+            pd.DataFrame({"hour": part["rollup_hour"], "rows": part["rollup_rows"],
+                          "threats": part["rollup_threats"]})
+            for part in self._iter_parts(start_ns, end_ns)
+        ]
+        if not frames:
+            return pd.DataFrame(columns=["hour", "rows", "threats"])
+        rollups = pd.concat(frames).groupby("hour", as_index=False).sum()
+        if start_ns is not None:
+            rollups = rollups[rollups["hour"] + _NS_PER_HOUR > start_ns]
+        if end_ns is not None:
+            rollups = rollups[rollups["hour"] < end_ns]
+        rollups["hour"] = rollups["hour"].astype("datetime64[ns]")
+        return rollups.reset_index(drop=True)
+
+_store = None
+
+def get_result_store():
+    global _store
+    if _store is None:
+        _store = ResultStore()
+    return _store
@@ -1,12 +1,31 @@
 # snowflake_ingest.py
 
 import logging
-import snowflake.connector
-from config import LOG_LEVEL
+import os
+import sys
+import tempfile
+import time
+import uuid
+import pandas as pd
+from config import (
+    INSERT_BATCH_SIZE, FETCH_BATCH_SIZE, LOG_COLUMNS, WAREHOUSE_WATERMARK_PATH,
+    LOG_LEVEL,
+)
+from data_loader import preprocess_logs, load_checkpoint, save_checkpoint
+from feature_engineering import extract_features
+
+# Optional: only needed for real Snowflake connections
+try:
+    import snowflake.connector
+except ImportError:
+    snowflake = None
 
 logging.basicConfig(level=LOG_LEVEL)
 
 def connect_to_snowflake(user, password, account, warehouse, database, schema):
+    if snowflake is None:
+        logging.error("Snowflake connection failed: snowflake-connector-python is not installed.")
+        return None
     try:
         conn = snowflake.connector.connect(
             user=user,
@@ -22,20 +41,191 @@ def connect_to_snowflake(user, password, account, warehouse, database, schema):
         logging.error(f"Snowflake connection failed: {e}")
         return None
 
-def insert_logs(conn, table_name, df):
+class DBAPIBackend:
+    # Any DB-API 2.0 connection. Subclasses cover driver differences: bind
+    # placeholders, value types, transactions and bulk loading.
+    placeholders = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+    def __init__(self, conn, paramstyle=None):
+        self.conn = conn
+        if paramstyle is None:
+            driver = sys.modules.get(type(conn).__module__.split(".")[0])
+            paramstyle = getattr(driver, "paramstyle", "pyformat")
+        self.paramstyle = paramstyle
+
+    def placeholder(self, position):
+        if self.paramstyle == "numeric":
+            return f":{position}"
+        return self.placeholders[self.paramstyle]
+
+    def insert_query(self, table_name, n_columns):
+        placeholders = ",".join(self.placeholder(i + 1) for i in range(n_columns))
+        return f"INSERT INTO {table_name} VALUES ({placeholders})"
+
+    def prepare_rows(self, df):
+        # Native Python values with None for missing, which every driver binds
+        return df.astype(object).where(df.notna(), None).to_numpy().tolist()
+
+    def begin(self, cursor):
+        # DB-API drivers open a transaction implicitly on the first statement
+        pass
+
+    def fetch_batches(self, cursor, batch_size):
+        columns = [d[0].lower() for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def stage_batch(self, cursor, table_name, df):
+        # No staging area on a generic connection; fall back to executemany
+        cursor.executemany(self.insert_query(table_name, df.shape[1]), self.prepare_rows(df))
+
+class SQLiteBackend(DBAPIBackend):
+
+    def __init__(self, conn):
+        super().__init__(conn, paramstyle="qmark")
+
+    def prepare_rows(self, df):
+        # sqlite3 has no timestamp type; store ISO-8601 strings
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = df[column].dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        return super().prepare_rows(df)
+
+class SnowflakeBackend(DBAPIBackend):
+
+    def __init__(self, conn):
+        super().__init__(conn, paramstyle="pyformat")
+
+    def begin(self, cursor):
+        # Snowflake autocommits each statement unless a transaction is open
+        cursor.execute("BEGIN")
+
+    def fetch_batches(self, cursor, batch_size):
+        # Result batches arrive as Arrow-backed DataFrames; no row tuples
+        for df in cursor.fetch_pandas_batches():
+            df.columns = [c.lower() for c in df.columns]
+            for start in range(0, len(df), batch_size):
+                yield df.iloc[start:start + batch_size]
+
+    def stage_batch(self, cursor, table_name, df):
+        # PUT the batch into the table stage as gzipped CSV, then COPY INTO
+        file_name = f"batch_{uuid.uuid4().hex}.csv.gz"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, file_name)
+            df.to_csv(path, index=False, header=False, compression="gzip")
+            cursor.execute(f"PUT file://{path} @%{table_name} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        cursor.execute(
+            f"COPY INTO {table_name} FROM @%{table_name} FILES=('{file_name}') "
+            "FILE_FORMAT=(TYPE=CSV COMPRESSION=GZIP FIELD_OPTIONALLY_ENCLOSED_BY='\"') "
+            "PURGE=TRUE"
+        )
+
+def get_backend(conn):
+    module = type(conn).__module__
+    if module.startswith("sqlite3"):
+        return SQLiteBackend(conn)
+    if module.startswith("snowflake"):
+        return SnowflakeBackend(conn)
+    return DBAPIBackend(conn)
+
+def insert_logs(conn, table_name, df, batch_size=INSERT_BATCH_SIZE, mode="executemany", backend=None):
+    # mode="executemany" sends multi-row inserts; mode="stage" bulk-loads each
+    # batch through a staged file. Each batch is its own transaction.
+    stats = {"rows": 0, "batches": 0, "seconds": 0.0, "rows_per_sec": 0.0}
     if df.empty:
         logging.warning("No data to insert into Snowflake.")
-        return
+        return stats
+    if mode not in ("executemany", "stage"):
+        raise ValueError(f"Unknown insert mode: {mode}")
 
+    backend = backend or get_backend(conn)
+    query = backend.insert_query(table_name, df.shape[1])
+    start = time.perf_counter()
     cursor = conn.cursor()
     try:
-        for _, row in df.iterrows():
-            values = tuple(row.values)
-            placeholders = ','.join(['%s'] * len(values))
-            query = f"INSERT INTO {table_name} VALUES ({placeholders})"
-            cursor.execute(query, values)
-        logging.info(f"Inserted {len(df)} rows into {table_name}.")
+        for offset in range(0, len(df), batch_size):
+            batch = df.iloc[offset:offset + batch_size]
+            try:
+                backend.begin(cursor)
+                if mode == "stage":
+                    backend.stage_batch(cursor, table_name, batch)
+                else:
+                    cursor.executemany(query, backend.prepare_rows(batch))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            stats["rows"] += len(batch)
+            stats["batches"] += 1
     except Exception as e:
         logging.error(f"Failed to insert logs: {e}")
     finally:
         cursor.close()
+        stats["seconds"] = time.perf_counter() - start
+        if stats["seconds"] > 0:
+            stats["rows_per_sec"] = stats["rows"] / stats["seconds"]
+
+    logging.info(
+        f"Inserted {stats['rows']} rows into {table_name} in {stats['batches']} batches "
+        f"({stats['rows_per_sec']:.0f} rows/s)."
+    )
+    return stats
+
+def extract_new_logs(conn, table_name, watermark=None, watermark_column="timestamp",
+                     columns=LOG_COLUMNS, batch_size=FETCH_BATCH_SIZE, backend=None):
+    # Yields DataFrame batches of rows strictly newer than the watermark, in
+    # watermark order, so the max of each batch is a valid next watermark.
+    backend = backend or get_backend(conn)
+    select = ", ".join(columns) if columns else "*"
+    query = f"SELECT {select} FROM {table_name}"
+    params = ()
+    if watermark is not None:
+        query += f" WHERE {watermark_column} > {backend.placeholder(1)}"
+        params = (watermark,)
+    query += f" ORDER BY {watermark_column}"
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        yield from backend.fetch_batches(cursor, batch_size)
+    finally:
+        cursor.close()
+
+def iter_new_log_features(conn, table_name, watermark_path=WAREHOUSE_WATERMARK_PATH,
+                          watermark_column="timestamp", batch_size=FETCH_BATCH_SIZE, backend=None):
+    # Feeds warehouse batches newer than the saved watermark straight into
+    # preprocessing and feature extraction. The watermark only advances once
+    # the consumer has taken a batch and asked for the next one, and only to
+    # a value whose rows have all been yielded: rows tied with a batch's last
+    # value may continue in the next batch, and extract_new_logs filters with
+    # a strict >, so saving that value could skip the rest of the tie.
+    watermarks = load_checkpoint(watermark_path)
+    watermark = watermarks.get(table_name)
+    logging.info(f"Extracting rows from {table_name} newer than {watermark}.")
+
+    def advance(value):
+        watermarks[table_name] = str(value)
+        save_checkpoint(watermark_path, watermarks)
+
+    previous = None  # watermark values of the last yielded batch
+    for batch in extract_new_logs(conn, table_name, watermark=watermark,
+                                  watermark_column=watermark_column,
+                                  batch_size=batch_size, backend=backend):
+        values = batch[watermark_column]
+        if previous is not None:
+            last = previous.iloc[-1]
+            if values.iloc[0] != last:
+                advance(last)
+            elif (previous != last).any():
+                # The tie continues: everything before it is fully consumed
+                advance(previous[previous != last].iloc[-1])
+        clean_logs = preprocess_logs(batch, source=table_name)
+        yield clean_logs, extract_features(clean_logs)
+        previous = values
+
+    if previous is not None:
+        advance(previous.iloc[-1])
@@ -6,10 +6,12 @@ This module powers real-time or batch predictions.
 ✔ Enforces correct feature ordering
 ✔ Cleans & validates incoming requests
 ✔ Compatible with FastAPI, Flask, and AWS Lambda
+✔ Hot-swaps newer registry versions from a background watcher
 ✔ Logs all inference steps
 """
 
 import logging
+import threading
 import numpy as np
 import pandas as pd
 from utils.config import get_config
@@ -28,13 +30,24 @@ class InferenceEngine:
     - Validate input data
     - Enforce column ordering from config
     - Run predictions safely
+    - Swap in newer registry versions without blocking requests
+
+    The loaded model is held as one (version, model) tuple. Each prediction
+    reads it once, and a refresh replaces it with a single assignment, so
+    in-flight requests finish on the model they started with.
     """
 
-    def __init__(self):
+    def __init__(self, model_name=None):
         logger.info("Initializing InferenceEngine...")
 
         self.cfg = get_config()
         self.registry = get_registry()
+        self.model_name = model_name or self.cfg.get(
+            "inference.model_name", "baseline_classifier"
+        )
+        self._refresh_lock = threading.Lock()
+        self._stop_watcher = threading.Event()
+        self._watcher = None
 
         # Load expected schema
         self.label_col = self.cfg.get("data.label_col")
@@ -47,7 +60,64 @@ class InferenceEngine:
 
         # Load latest model
         logger.info("Loading latest model from registry...")
-        self.model = self.registry.load_model("baseline_classifier")
+        version = self.registry.latest_version(self.model_name)
+        self._current = (version, self.registry.load_model(self.model_name, version))
+
+    @property
+    def model(self):
+        return self._current[1]
+
+    @property
+    def model_version(self):
+        return self._current[0]
+
+    # ----------------------------------------------------
+    # Hot swap
+    # ----------------------------------------------------
+    def refresh(self):
+        """
+        Load the newest registry version if it is newer than the one being
+        served, then swap it in. Deserialization happens here, on the
+        caller's (watcher's) thread, never on the request path.
+        Returns True when a new version was swapped in.
+        """
+        with self._refresh_lock:
+            current = self._current[0]
+            latest = self.registry.latest_version(self.model_name)
+            if latest <= current:
+                return False
+
+            model = self.registry.load_model(self.model_name, latest)
+            self._current = (latest, model)
+
+        logger.info(f"[SWAPPED] {self.model_name} v{current} -> v{latest}")
+        return True
+
+    def start_watcher(self, interval_seconds):
+        """Poll the registry every interval_seconds from a daemon thread."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def watch():
+            while not self._stop_watcher.wait(interval_seconds):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep serving the current model; retry on the next tick
+                    logger.error(f"[REFRESH ERROR] {e}")
+
+        self._stop_watcher.clear()
+        self._watcher = threading.Thread(
+            target=watch, name="ModelRegistryWatcher", daemon=True
+        )
+        self._watcher.start()
+        logger.info(f"Watching registry for new {self.model_name} versions every {interval_seconds}s")
+
+    def stop_watcher(self, timeout=None):
+        self._stop_watcher.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout)
+            self._watcher = None
 
     def _validate_and_format_input(self, data):
         """
@@ -95,7 +165,9 @@ class InferenceEngine:
         """
         try:
             df = self._validate_and_format_input(data)
-            preds = self.model.predict(df)
+            # One read of the current model for the whole request
+            _, model = self._current
+            preds = model.predict(df)
 
             logger.info(f"Predictions generated — count: {len(preds)}")
             return preds.tolist()
@@ -105,6 +177,17 @@ class InferenceEngine:
             raise
 
 
-# Global accessor for APIs
+# Global accessor for APIs: one engine (and one loaded model) per process
+_engine = None
+_engine_lock = threading.Lock()
+
+
 def get_inference_engine():
-    return InferenceEngine()
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = InferenceEngine()
+            interval = float(get_config().get("inference.reload_interval_seconds", 0) or 0)
+            if interval > 0:
+                _engine.start_watcher(interval)
+        return _engine
@@ -14,6 +14,7 @@ This is the enterprise-grade inference flow.
 """
 
 import logging
+import threading
 import pandas as pd
 from pathlib import Path
 
@@ -78,6 +79,27 @@ class InferencePipeline:
 
         return preds
 
+    def validate_record(self, record):
+        """
+        Check that a single record can be scored on its own.
+
+        Preprocessing fills a missing feature without a configured fill value
+        from the column mean of whatever it is given, so a micro-batched
+        record would be imputed from other callers' data. Such records are
+        rejected here, before they join a batch.
+        """
+        if not isinstance(record, dict):
+            raise ValueError("Record must be a dict of feature values.")
+
+        fill_values = self.preprocessor.fill_values or {}
+        missing = [
+            col for col in self.features
+            if col not in fill_values
+            and pd.api.types.is_scalar(record.get(col)) and pd.isna(record.get(col))
+        ]
+        if missing:
+            raise ValueError(f"Missing required features in record: {missing}")
+
     # ----------------------------------------------------
     # BATCH INFERENCE
     # ----------------------------------------------------
@@ -126,12 +148,24 @@ class InferencePipeline:
         return df_output
 
 
+# Built once per worker process: preprocessing config and the model stay
+# warm, and the engine swaps in newer registry versions in the background.
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_inference_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = InferencePipeline()
+        return _pipeline
+
+
 # Global accessor for orchestration engines
 def run_realtime_inference(data):
-    pipeline = InferencePipeline()
-    return pipeline.predict(data)
+    return get_inference_pipeline().predict(data)
 
 
 def run_batch_inference(input_file, output_file=None):
-    pipeline = InferencePipeline()
-    return pipeline.batch_predict(input_file, output_file)
+    return get_inference_pipeline().batch_predict(input_file, output_file)
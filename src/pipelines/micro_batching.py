@@ -0,0 +1,209 @@
+"""
+micro_batching.py — Adaptive Micro-Batching for Real-Time Inference
+
+This module provides:
+✔ An asyncio queue that gathers concurrent single-record requests
+✔ Batches bounded by a maximum size and a maximum wait (ms)
+✔ One vectorized predict per batch, off the event loop
+✔ Per-record validation before a record joins a batch
+✔ Per-caller results (a bad record only fails its own request)
+✔ Batch-size and queue-wait histograms for tuning
+
+Batching adapts to load: while one batch is being predicted, new requests
+queue up and form the next batch, and the max-wait timer is only spent when
+recent batches show concurrent traffic, so a lone request is not delayed.
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("MicroBatcher")
+logger.setLevel(logging.INFO)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with cumulative (Prometheus-style) counts.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+
+class MicroBatcher:
+    """
+    Gathers records submitted concurrently from async handlers and runs
+    predict_fn (list of records -> list of results, same order) once per
+    batch on a dedicated worker thread.
+
+    validate_fn, if given, is called on each record before it is queued and
+    should raise for a record that cannot be scored on its own. Anything
+    predict_fn computes across the batch (e.g. imputing a missing value
+    from the batch mean) would otherwise mix data from unrelated callers.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0, validate_fn=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.validate_fn = validate_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = float(max_wait_ms) / 1000.0
+
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_MS_BUCKETS)
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "failed_batches": 0}
+
+        # Smoothed batch size; >= 2 means requests are arriving concurrently
+        self._recent_batch_size = 1.0
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MicroBatcher")
+
+    # ----------------------------------------------------
+    # Lifecycle
+    # ----------------------------------------------------
+    def start(self):
+        """Start the batching loop on the running event loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(
+                f"Micro-batching on: max_batch_size={self.max_batch_size}, "
+                f"max_wait_ms={self.max_wait * 1000:g}"
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    # ----------------------------------------------------
+    # Request path
+    # ----------------------------------------------------
+    async def submit(self, record):
+        """Queue one record and wait for its own prediction."""
+        if self._task is None:
+            raise RuntimeError("MicroBatcher is not running.")
+        if self.validate_fn is not None:
+            try:
+                self.validate_fn(record)
+            except Exception:
+                self.stats["rejected"] += 1
+                raise
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future, time.perf_counter()))
+        self.stats["requests"] += 1
+        return await future
+
+    def metrics(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            **self.stats,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+    # ----------------------------------------------------
+    # Batching loop
+    # ----------------------------------------------------
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+
+        # Whatever is already queued joins immediately
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        # Under concurrent load, hold the batch open up to max_wait for more
+        if self._recent_batch_size >= 2 and self.max_wait > 0:
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            dispatched = time.perf_counter()
+            for _, _, queued in batch:
+                self.queue_wait_ms.observe((dispatched - queued) * 1000)
+            self.batch_sizes.observe(len(batch))
+            self.stats["batches"] += 1
+            self._recent_batch_size = 0.8 * self._recent_batch_size + 0.2 * len(batch)
+
+            records = [record for record, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self._predict_batch, records)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future, _), result in zip(batch, results):
+                if future.done():  # caller went away
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _predict_batch(self, records):
+        """
+        One vectorized call for the whole batch. If it fails (e.g. one record
+        is missing a feature), fall back to per-record calls so only the
+        offending requests get the error.
+        """
+        try:
+            results = list(self.predict_fn(records))
+            if len(results) != len(records):
+                raise ValueError(f"predict returned {len(results)} results for {len(records)} records")
+            return results
+        except Exception as e:
+            if len(records) == 1:
+                return [e]
+            self.stats["failed_batches"] += 1
+            logger.warning(f"Batch of {len(records)} failed ({e}); retrying per record.")
+
+        results = []
+        for record in records:
+            try:
+                results.append(self.predict_fn([record])[0])
+            except Exception as e:
+                results.append(e)
+        return results
@@ -49,6 +49,10 @@ class ModelRegistry:
         versions = [int(f.stem.split("_v")[-1]) for f in existing]
         return max(versions) + 1
 
+    def latest_version(self, model_name: str):
+        """Return the newest saved version number (0 if none exist)."""
+        return self._get_next_version(model_name) - 1
+
     def save_model(self, model, model_name: str):
         """Save a versioned model with metadata."""
         version = self._get_next_version(model_name)
@@ -56,12 +60,16 @@ class ModelRegistry:
         metadata_file = self.registry_dir / f"{model_name}_v{version}.json"
 
         try:
-            # Save model
-            with open(model_file, "wb") as f:
+            # Write the pickle to a temp file and its metadata first, then
+            # rename the pickle into place last: a watcher polling the
+            # registry only sees a version once its .pkl exists, so it never
+            # loads a half-written model or finds stale/missing metadata
+            tmp_file = model_file.with_name(model_file.name + ".tmp")
+            with open(tmp_file, "wb") as f:
                 pickle.dump(model, f)
 
             # Compute fingerprint
-            fingerprint = self._compute_sha256(model_file)
+            fingerprint = self._compute_sha256(tmp_file)
 
             # Metadata
             metadata = {
@@ -70,12 +78,16 @@ class ModelRegistry:
                 "file_path": str(model_file),
                 "fingerprint_sha256": fingerprint,
                 "timestamp": datetime.utcnow().isoformat(),
-                "size_kb": round(model_file.stat().st_size / 1024, 2),
+                "size_kb": round(tmp_file.stat().st_size / 1024, 2),
             }
 
-            # Save metadata
-            with open(metadata_file, "w") as f:
+            # Save metadata (also via temp file + rename)
+            tmp_metadata = metadata_file.with_name(metadata_file.name + ".tmp")
+            with open(tmp_metadata, "w") as f:
                 json.dump(metadata, f, indent=4)
+            tmp_metadata.replace(metadata_file)
+
+            tmp_file.replace(model_file)
 
             logger.info(f"[SAVED] Model '{model_name}' v{version}")
             logger.info(f"Location: {model_file}")
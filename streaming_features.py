@@ -0,0 +1,209 @@
+# streaming_features.py
+
+import logging
+import math
+import numpy as np
+import pandas as pd
+from config import (
+    IP_COUNT_WINDOWS, IP_COUNT_BUCKET_SECONDS, IP_SKETCH_WIDTH,
+    IP_SKETCH_DEPTH, RANDOM_SEED, LOG_LEVEL,
+)
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Upper bound on the (buckets x distinct keys) prefix-sum table built per query
+_MAX_TABLE_CELLS = 2 ** 22
+
+def _epoch_seconds(timestamps):
+    ts = pd.Series(timestamps)
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        ts = ts.dt.tz_convert(None)
+    valid = ts.notna().to_numpy()
+    seconds = np.zeros(len(ts), dtype=np.int64)
+    seconds[valid] = ts[valid].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return seconds, valid
+
+class IPWindowCounter:
+    # Keeps per-key event counts in fixed time buckets and answers "how many
+    # events did this key have in the last <window>" across batches. Buckets
+    # older than the longest window are evicted, so memory is bounded by the
+    # number of live buckets times the keys per bucket (or the sketch size).
+
+    def __init__(self, windows=IP_COUNT_WINDOWS,
+                 bucket_seconds=IP_COUNT_BUCKET_SECONDS, sketch=False,
+                 sketch_width=IP_SKETCH_WIDTH, sketch_depth=IP_SKETCH_DEPTH,
+                 seed=RANDOM_SEED):
+        if bucket_seconds <= 0:
+            raise ValueError("bucket_seconds must be positive")
+        self.windows = dict(windows)
+        self.bucket_seconds = int(bucket_seconds)
+        self.window_buckets = {
+            name: max(1, math.ceil(seconds / self.bucket_seconds))
+            for name, seconds in self.windows.items()
+        }
+        self.horizon = max(self.window_buckets.values())
+        self.sketch = sketch
+        self.sketch_width = int(sketch_width)
+        self.sketch_depth = int(sketch_depth)
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        self._hash_a = rng.integers(1, 2 ** 63, size=self.sketch_depth, dtype=np.uint64) | np.uint64(1)
+        self._hash_b = rng.integers(0, 2 ** 63, size=self.sketch_depth, dtype=np.uint64)
+
+        # bucket id -> pd.Series(count, index=key) or (depth, width) sketch
+        self._buckets = {}
+        self._latest_bucket = None
+
+    def _sketch_columns(self, keys):
+        hashed = pd.util.hash_array(np.asarray(keys, dtype=object))
+        mixed = hashed[None, :] * self._hash_a[:, None] + self._hash_b[:, None]
+        return (mixed >> np.uint64(32)) % np.uint64(self.sketch_width)
+
+    def update(self, timestamps, keys, evict=True):
+        seconds, valid = _epoch_seconds(timestamps)
+        if not valid.any():
+            return
+        buckets = seconds[valid] // self.bucket_seconds
+        keys = np.asarray(keys, dtype=object)[valid]
+
+        # Events are late only relative to what earlier batches already evicted
+        cutoff = -np.inf if self._latest_bucket is None else self._latest_bucket - self.horizon
+        newest = int(buckets.max())
+        if self._latest_bucket is None or newest > self._latest_bucket:
+            self._latest_bucket = newest
+
+        grouped = pd.DataFrame({"bucket": buckets, "key": keys}).groupby(
+            ["bucket", "key"], sort=False).size()
+        late = 0
+        for bucket, counts in grouped.groupby(level="bucket", sort=False):
+            bucket = int(bucket)
+            if bucket <= cutoff:
+                late += int(counts.sum())
+                continue
+            counts = counts.droplevel("bucket")
+            if self.sketch:
+                table = self._buckets.get(bucket)
+                if table is None:
+                    table = np.zeros((self.sketch_depth, self.sketch_width), dtype=np.int64)
+                    self._buckets[bucket] = table
+                columns = self._sketch_columns(counts.index.to_numpy())
+                values = counts.to_numpy()
+                for row in range(self.sketch_depth):
+                    np.add.at(table[row], columns[row], values)
+            else:
+                existing = self._buckets.get(bucket)
+                self._buckets[bucket] = counts if existing is None else existing.add(counts, fill_value=0).astype(np.int64)
+
+        if late:
+            logging.warning(f"Dropped {late} events older than the longest count window.")
+        if evict:
+            self.evict()
+
+    def evict(self):
+        if self._latest_bucket is None:
+            return
+        cutoff = self._latest_bucket - self.horizon
+        for bucket in [b for b in self._buckets if b <= cutoff]:
+            del self._buckets[bucket]
+
+    def _bucket_counts(self, bucket, keys, columns):
+        stored = self._buckets[bucket]
+        if self.sketch:
+            return stored[np.arange(self.sketch_depth)[:, None], columns].min(axis=0)
+        return stored.reindex(keys, fill_value=0).to_numpy(dtype=np.int64)
+
+    def counts(self, timestamps, keys):
+        # Counts are at bucket granularity: each row sees every event of its
+        # key in the buckets its window covers, up to and including its own.
+        seconds, valid = _epoch_seconds(timestamps)
+        result = {f"ip_count_{name}": np.zeros(len(seconds), dtype=np.int64) for name in self.windows}
+        if not valid.any() or not self._buckets:
+            return pd.DataFrame(result)
+
+        rows = np.flatnonzero(valid)
+        row_buckets = seconds[rows] // self.bucket_seconds
+        codes, uniques = pd.factorize(np.asarray(keys, dtype=object)[rows])
+
+        lowest = row_buckets.min() - self.horizon
+        highest = row_buckets.max()
+        bucket_ids = np.array(sorted(b for b in self._buckets if lowest < b <= highest), dtype=np.int64)
+        if bucket_ids.size == 0:
+            return pd.DataFrame(result)
+
+        hi = np.searchsorted(bucket_ids, row_buckets, side="right")
+        lo = {name: np.searchsorted(bucket_ids, row_buckets - n, side="right")
+              for name, n in self.window_buckets.items()}
+
+        # Process distinct keys in chunks so the prefix table stays bounded
+        chunk = max(1, _MAX_TABLE_CELLS // (bucket_ids.size + 1))
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(0, len(uniques) + chunk, chunk))
+        for start, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if begin == end:
+                continue
+            key_slice = uniques[start * chunk:(start + 1) * chunk]
+            columns = self._sketch_columns(key_slice) if self.sketch else None
+            table = np.zeros((bucket_ids.size + 1, len(key_slice)), dtype=np.int64)
+            for i, bucket in enumerate(bucket_ids):
+                table[i + 1] = self._bucket_counts(int(bucket), key_slice, columns)
+            np.cumsum(table, axis=0, out=table)
+
+            picked = order[begin:end]
+            local = codes[picked] - start * chunk
+            for name in self.windows:
+                result[f"ip_count_{name}"][rows[picked]] = (
+                    table[hi[picked], local] - table[lo[name][picked], local])
+
+        return pd.DataFrame(result)
+
+    def transform(self, timestamps, keys):
+        # Evict only after counting so rows early in a long batch still see
+        # the rest of their own window.
+        self.update(timestamps, keys, evict=False)
+        counts = self.counts(timestamps, keys)
+        self.evict()
+        counts.index = getattr(timestamps, "index", counts.index)
+        return counts
+
+    def snapshot(self):
+        # Plain JSON types, so the state can ride along in the follow
+        # checkpoint; sketch tables keep only their non-zero cells
+        buckets = {}
+        for bucket, stored in self._buckets.items():
+            if self.sketch:
+                cells = np.flatnonzero(stored)
+                buckets[str(bucket)] = [cells.tolist(), stored.ravel()[cells].tolist()]
+            else:
+                buckets[str(bucket)] = [stored.index.tolist(), stored.to_numpy(dtype=np.int64).tolist()]
+        return {
+            "windows": dict(self.windows),
+            "bucket_seconds": self.bucket_seconds,
+            "sketch": self.sketch,
+            "sketch_width": self.sketch_width,
+            "sketch_depth": self.sketch_depth,
+            "seed": self.seed,
+            "latest_bucket": self._latest_bucket,
+            "buckets": buckets,
+        }
+
+    @classmethod
+    def restore(cls, state):
+        counter = cls(
+            windows=state["windows"],
+            bucket_seconds=state["bucket_seconds"],
+            sketch=state["sketch"],
+            sketch_width=state["sketch_width"],
+            sketch_depth=state["sketch_depth"],
+            seed=state["seed"],
+        )
+        counter._latest_bucket = state["latest_bucket"]
+        for bucket, (labels, counts) in state["buckets"].items():
+            if counter.sketch:
+                table = np.zeros((counter.sketch_depth, counter.sketch_width), dtype=np.int64)
+                table.ravel()[np.asarray(labels, dtype=np.intp)] = counts
+                counter._buckets[int(bucket)] = table
+            else:
+                counter._buckets[int(bucket)] = pd.Series(counts, index=pd.Index(labels, dtype=object),
+                                                          dtype=np.int64)
+        return counter
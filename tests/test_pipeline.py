@@ -1,10 +1,43 @@
 # tests/test_pipeline.py
 
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
 import pandas as pd
-from data_loader import preprocess_logs
-from feature_engineering import extract_features
-from model import train_model
-from detector import detect_threats
+import pytest
+import api
+import keyword_matcher
+from alert import AlertDispatcher
+from compact_model import CompactForest
+from config import ANOMALY_THRESHOLD, DEFAULT_KEYWORD_FAMILIES
+from data_loader import preprocess_logs, follow_log_data, load_log_batches, load_checkpoint
+from detector import (
+    detect_threats, score_threats, select_threats, cascade_prefilter,
+    get_detection_stats, reset_detection_stats,
+)
+from feature_engineering import extract_features, build_model_input
+from index_codec import encode_indices, decode_indices
+from ip_utils import parse_ips, format_ips, ipv4_to_uint32, is_valid_ip
+from keyword_matcher import KeywordMatcher
+from model import (
+    train_model, refresh_model, save_model, get_cached_model,
+    get_model_cache_stats, clear_model_cache,
+)
+from result_store import ResultStore
+from snowflake_ingest import insert_logs, iter_new_log_features
+from streaming_features import IPWindowCounter
+from threat_scoring import apply_threat_scores, rank_threats
+from training_sample import ReservoirSampler, build_training_sample
+from timestamp_parser import parse_timestamps, detect_timestamp_format
 
 def test_preprocess_logs():
     raw = pd.DataFrame({
@@ -37,3 +70,875 @@ def test_model_training_and_detection():
     assert model is not None
     threats = detect_threats(df)
     assert isinstance(threats, list)
+
+def test_model_cache_reloads_on_change(tmp_path):
+    df = pd.DataFrame({
+        'hour': [12, 13, 14],
+        'ip_freq': [5, 3, 8],
+        'suspicious_flag': [1, 0, 1]
+    })
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(df), path)
+    clear_model_cache()
+
+    first = get_cached_model(path)
+    assert get_cached_model(path) is first
+    save_model(train_model(pd.concat([df, df])), path)
+    assert get_cached_model(path) is not first
+
+    stats = get_model_cache_stats()
+    assert (stats["misses"], stats["hits"], stats["reloads"]) == (1, 1, 1)
+    assert get_cached_model(str(tmp_path / "missing.pkl")) is None
+
+def test_score_threats_and_selection():
+    df = pd.DataFrame({
+        'hour': [12, 13, 14, 12, 3],
+        'ip_freq': [5, 3, 8, 5, 90],
+        'suspicious_flag': [1, 0, 1, 1, 1]
+    })
+    model = train_model(df)
+    scores = score_threats(df, model=model)
+    assert isinstance(scores, np.ndarray) and scores.shape == (5,)
+    assert np.allclose(scores, -model.score_samples(df))
+
+    ranked = select_threats(scores, threshold=None, top_k=2)
+    assert ranked.tolist() == np.argsort(-scores, kind="stable")[:2].tolist()
+    above = select_threats(scores, threshold=0.5)
+    assert above.tolist() == np.flatnonzero(scores >= 0.5).tolist()
+    assert select_threats(scores, threshold=2.0, top_k=3).size == 0
+
+def test_detect_threats_uses_configured_threshold(tmp_path):
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(rng.normal(size=(500, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    # A few far-off rows score above ANOMALY_THRESHOLD, the bulk below it
+    features.iloc[:8] = rng.normal(loc=12, size=(8, 3))
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(features), path)
+    scores = score_threats(features, model_path=path)
+    assert scores.max() >= ANOMALY_THRESHOLD > scores.min()
+
+    flagged = detect_threats(features, model_path=path)
+    assert flagged and all(scores[i] >= ANOMALY_THRESHOLD for i in flagged)
+    assert flagged == np.flatnonzero(scores >= ANOMALY_THRESHOLD).tolist()
+
+    cut = np.quantile(scores, 0.9)
+    assert detect_threats(features, threshold=cut, model_path=path) == np.flatnonzero(scores >= cut).tolist()
+    # top_k ranks within the threshold instead of ignoring it
+    ranked = detect_threats(features, threshold=cut, top_k=5, model_path=path)
+    assert ranked == select_threats(scores, threshold=cut, top_k=5).tolist()
+    assert all(scores[i] >= cut for i in ranked)
+    assert len(detect_threats(features, threshold=2.0, top_k=5, model_path=path)) == 0
+
+def test_detect_threats_default_is_the_fixed_threshold(tmp_path):
+    # The default cut is ANOMALY_THRESHOLD on the anomaly score, not the
+    # contamination-based predict() labels (threshold=None)
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(rng.normal(size=(500, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    features.iloc[:8] = rng.normal(loc=12, size=(8, 3))
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(features), path)
+
+    flagged = detect_threats(features, model_path=path)
+    predicted = detect_threats(features, threshold=None, model_path=path)
+    assert flagged == detect_threats(features, threshold=ANOMALY_THRESHOLD, model_path=path)
+    assert predicted == np.flatnonzero(get_cached_model(path).predict(features) == -1).tolist()
+    # Contamination 0.1 labels ~50 rows; the fixed cut only the 8 outliers
+    assert sorted(flagged) == list(range(8)) and len(predicted) > len(flagged)
+
+def test_ip_window_counter_spans_batches():
+    ts = pd.Series(pd.to_datetime([
+        '2025-09-28 12:00:00', '2025-09-28 12:00:10',
+        '2025-09-28 12:02:00', '2025-09-28 14:00:00',
+    ]))
+    ips = ['10.0.0.1', '10.0.0.1', '10.0.0.1', '10.0.0.1']
+    for sketch in (False, True):
+        counter = IPWindowCounter(sketch=sketch)
+        first = counter.transform(ts.iloc[:2], ips[:2])
+        second = counter.transform(ts.iloc[2:], ips[2:])
+        assert first['ip_count_1m'].tolist() == [2, 2]
+        assert second['ip_count_5m'].tolist() == [3, 1]
+        assert second['ip_count_1h'].tolist() == [3, 1]
+
+        # Survives a JSON round trip, as in the follow checkpoint
+        restored = IPWindowCounter.restore(json.loads(json.dumps(counter.snapshot())))
+        again = restored.counts(ts.iloc[3:], ips[3:])
+        assert again['ip_count_1h'].tolist() == [1]
+
+def test_keyword_matcher_counts_per_family(monkeypatch):
+    families = {'auth': ['unauthorized', 'failed'], 'error': ['error', 'err']}
+    messages = pd.Series(['Login FAILED', 'error: unauthorized', None, 'ok'])
+    expected = [[1, 0], [1, 2], [0, 0], [0, 0]]
+    assert KeywordMatcher(families).count(messages).tolist() == expected
+
+    # The pure-Python automaton must agree with the optional C extension
+    monkeypatch.setattr(keyword_matcher, 'ahocorasick', None)
+    assert KeywordMatcher(families).count(messages).tolist() == expected
+
+def test_keyword_families_load_independent_of_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    families = keyword_matcher.load_keyword_families()
+    assert 'auth_failure' in families and 'malware' in families
+    with pytest.raises(FileNotFoundError):
+        keyword_matcher.load_keyword_families(str(tmp_path / "missing.yaml"))
+    assert keyword_matcher.load_keyword_families(None) == DEFAULT_KEYWORD_FAMILIES
+
+def test_parse_timestamps_formats_and_fallback():
+    epoch_ms = pd.Series([1759060800000, 1759064400000])
+    assert detect_timestamp_format(epoch_ms) == 'epoch_ms'
+    assert parse_timestamps(epoch_ms).dt.hour.tolist() == [12, 13]
+
+    mixed = pd.Series(['2025-09-28 12:00:00'] * 20 + ['2025-09-28T14:30:00Z', 'garbage'])
+    parsed = parse_timestamps(mixed, source='test')
+    assert parsed.iloc[-2] == pd.Timestamp('2025-09-28 14:30:00')
+    assert pd.isna(parsed.iloc[-1])
+
+def test_parse_timestamps_mixed_offsets_and_compact_dates():
+    # Offsets change across the DST switch; both paths must parse them as UTC
+    dst = pd.Series(['2025-10-26T01:30:00+02:00'] * 3 + ['2025-10-26T02:30:00+01:00'] * 3)
+    expected = [pd.Timestamp('2025-10-25 23:30:00')] * 3 + [pd.Timestamp('2025-10-26 01:30:00')] * 3
+    assert parse_timestamps(dst).tolist() == expected
+    late_switch = pd.concat([dst.head(3)] * 20 + [dst.tail(3)], ignore_index=True)
+    assert parse_timestamps(late_switch).iloc[-1] == expected[-1]
+    logs = preprocess_logs(pd.DataFrame({'timestamp': dst, 'source_ip': ['10.0.0.1'] * 6, 'message': ['ok'] * 6}))
+    assert len(logs) == 6
+
+    # Compact dates are ISO 8601 basic format
+    compact = pd.Series([20250928, 20250929])
+    assert parse_timestamps(compact).tolist() == [pd.Timestamp('2025-09-28'), pd.Timestamp('2025-09-29')]
+    assert detect_timestamp_format(pd.Series(['20250928120000'])) == '%Y%m%d%H%M%S'
+    assert detect_timestamp_format(pd.Series([1759060800, 1759064400])) == 'epoch_s'
+
+def test_parse_timestamps_paths_agree_on_zone():
+    # Same instants through the detected-format path, the per-row fallback
+    # and the whole-series mixed path: naive UTC, same dtype and hour
+    values = ['2025-09-28T14:30:00+02:00', '2025-09-28T12:30:00Z', '2025-09-28 12:30:00']
+    fast = parse_timestamps(pd.Series(values * 20))
+    fallback = parse_timestamps(pd.Series(['2025-09-28 12:00:00'] * 30 + ['28/Sep/2025:14:30:00 +0200']))
+    odd = pd.Series(['Sep 28 2025 12:30', 'Sun, 28 Sep 2025 14:30:00 +0200'])
+    mixed = parse_timestamps(odd)
+    assert detect_timestamp_format(pd.Series(values * 20)) == 'ISO8601'
+    assert detect_timestamp_format(odd) is None
+    for parsed in (fast, fallback, mixed):
+        assert parsed.dtype == fast.dtype and getattr(parsed.dt, 'tz', None) is None
+    assert fast.dt.hour.tolist() == [12] * 60
+    assert fallback.iloc[-1] == pd.Timestamp('2025-09-28 12:30:00')
+    assert mixed.dt.hour.tolist() == [12] * 2
+
+def test_follow_log_data_resumes_from_offset(tmp_path):
+    path = tmp_path / "logs.csv"
+    path.write_text(
+        "timestamp,source_ip,message\n"
+        "2025-09-28 12:00:00,10.0.0.1,ok\n"
+        "2025-09-28 12:00:01,10.0.0.2,login failed\n"
+        "2025-09-28 12:00:02,10.0.0.3,ok\n"
+        "2025-09-28 12:00:03,10.0.0.4,partial"
+    )
+    batches = list(follow_log_data(str(path), batch_rows=2, stop_when_idle=True))
+    assert [len(batch) for batch, _, _ in batches] == [2, 1]
+    _, offset, file_id = batches[-1]
+
+    with open(path, "a") as f:
+        f.write(" line\n2025-09-28 12:00:04,10.0.0.5,ok\n")
+    resumed = list(follow_log_data(str(path), offset=offset, file_id=file_id, stop_when_idle=True))
+    assert len(resumed) == 1
+    assert resumed[0][0]['message'].tolist() == ['partial line', 'ok']
+    assert resumed[0][1] == path.stat().st_size
+
+def test_follow_log_data_skips_bad_lines_and_detects_rotation(tmp_path):
+    path = tmp_path / "logs.csv"
+    path.write_text(
+        "timestamp,source_ip,message\n"
+        "2025-09-28 12:00:00,10.0.0.1,ok\n"
+        "2025-09-28 12:00:01,10.0.0.2,too,many,fields\n"
+        '2025-09-28 12:00:02,10.0.0.3,"unterminated\n'
+        "2025-09-28 12:00:03,10.0.0.4,ok\n"
+    )
+    [(batch, offset, file_id)] = list(follow_log_data(str(path), stop_when_idle=True))
+    # Bad lines are dropped, the batch and its offset still go through
+    assert batch['source_ip'].tolist() == ['10.0.0.1', '10.0.0.4']
+    assert offset == path.stat().st_size
+
+    # Rotated file already longer than the old offset: read from the top
+    rotated = tmp_path / "rotated.csv"
+    rotated.write_text("timestamp,source_ip,message\n" + "".join(
+        f"2025-09-29 00:00:{i:02d},10.0.1.{i},ok\n" for i in range(10)))
+    rotated.replace(path)
+    assert path.stat().st_size > offset
+    resumed = list(follow_log_data(str(path), offset=offset, file_id=file_id, stop_when_idle=True))
+    assert sum(len(batch) for batch, _, _ in resumed) == 10
+
+def _stub_follow_model(monkeypatch):
+    # run_follow without a saved model: training records the row count and
+    # detection flags 'login failed' rows and records the features it saw
+    import main
+    trained, alerts, scored = [], [], []
+
+    def detect(features, logs=None, as_array=False):
+        scored.append(features)
+        return np.flatnonzero(logs['message'].to_numpy() == 'login failed')
+
+    monkeypatch.setattr(main, 'get_cached_model', lambda: 'model' if trained else None)
+    monkeypatch.setattr(main, 'train_model', lambda features: trained.append(features.shape[0]) or 'model')
+    monkeypatch.setattr(main, 'save_model', lambda model, path=None: None)
+    monkeypatch.setattr(main, 'detect_threats', detect)
+    monkeypatch.setattr(main, 'send_console_alert', lambda rows: None)
+    monkeypatch.setattr(main, 'dispatch_webhook_alert', lambda rows, key=None: alerts.extend(rows))
+    return main, trained, alerts, scored
+
+def test_run_follow_keys_alerts_by_line_offset_and_waits_to_train(tmp_path, monkeypatch):
+    main, trained, alerts, _ = _stub_follow_model(monkeypatch)
+
+    path = tmp_path / "logs.csv"
+    checkpoint = str(tmp_path / "checkpoint.json")
+    path.write_text(
+        "timestamp,source_ip,message\n"
+        "2025-09-28 12:00:00,10.0.0.1,ok\n"
+        "2025-09-28 12:00:01,10.0.0.2,too,many,fields\n"
+        "2025-09-28 12:00:02,10.0.0.3,login failed\n"
+    )
+    main.run_follow(str(path), checkpoint, stop_when_idle=True, min_train_rows=4)
+    # Too few rows to train on: nothing scored, nothing checkpointed
+    assert trained == [] and alerts == [] and not os.path.exists(checkpoint)
+
+    with open(path, "a") as f:
+        f.write("2025-09-28 12:00:03,10.0.0.4,ok\n2025-09-28 12:00:04,10.0.0.5,login failed\n")
+    main.run_follow(str(path), checkpoint, stop_when_idle=True, min_train_rows=4)
+    assert trained == [4]
+    # Alert keys are byte offsets of the flagged lines, past the skipped one
+    with open(path, "rb") as f:
+        flagged = []
+        for offset in alerts:
+            f.seek(offset)
+            flagged.append(f.readline().decode())
+    assert flagged == ["2025-09-28 12:00:02,10.0.0.3,login failed\n",
+                       "2025-09-28 12:00:04,10.0.0.5,login failed\n"]
+
+def test_run_follow_window_counts_survive_restarts(tmp_path, monkeypatch):
+    main, _, _, scored = _stub_follow_model(monkeypatch)
+    path = tmp_path / "logs.csv"
+    checkpoint = str(tmp_path / "checkpoint.json")
+    path.write_text("timestamp,source_ip,message\n" + "".join(
+        f"2025-09-28 12:00:{i:02d},10.0.0.1,ok\n" for i in range(3)))
+    main.run_follow(str(path), checkpoint, stop_when_idle=True, min_train_rows=1, ip_window_counts=True)
+    assert scored[-1]['ip_count_5m'].tolist() == [3, 3, 3]
+    assert 'ip_counts' in load_checkpoint(checkpoint)
+
+    # A restart picks the counts up from the checkpoint
+    with open(path, "a") as f:
+        f.write("2025-09-28 12:00:10,10.0.0.1,ok\n2025-09-28 12:00:11,10.0.0.2,ok\n")
+    main.run_follow(str(path), checkpoint, stop_when_idle=True, min_train_rows=1, ip_window_counts=True)
+    assert scored[-1]['ip_count_5m'].tolist() == [4, 1]
+
+def test_load_log_batches_reads_mixed_formats(tmp_path):
+    logs = pd.DataFrame({
+        'timestamp': ['2025-09-28 12:00:00', '2025-09-28 12:00:01', '2025-09-28 12:00:02'],
+        'source_ip': ['10.0.0.1', '10.0.0.2', '10.0.0.3'],
+        'message': ['ok', 'login failed', 'ok'],
+        'user_agent': ['curl', 'curl', 'curl'],
+    })
+    logs.to_csv(tmp_path / 'a.csv', index=False)
+    logs.to_csv(tmp_path / 'b.csv.gz', index=False)
+    logs.to_json(tmp_path / 'c.jsonl', orient='records', lines=True)
+
+    batches = list(load_log_batches(str(tmp_path), max_workers=2, batch_rows=2))
+    assert [len(batch) for batch in batches] == [2, 1, 2, 1, 2, 1]
+    assert all(list(batch.columns) == ['timestamp', 'source_ip', 'message'] for batch in batches)
+
+def test_insert_logs_batches_into_sqlite():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE logs (timestamp TEXT, source_ip TEXT, message TEXT)")
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2025-09-28 12:00:00', periods=25, freq='s'),
+        'source_ip': ['10.0.0.1'] * 25,
+        'message': ['ok'] * 24 + [None],
+    })
+    stats = insert_logs(conn, "logs", df, batch_size=10)
+    assert (stats["rows"], stats["batches"]) == (25, 3)
+    assert conn.execute("SELECT COUNT(*), COUNT(message) FROM logs").fetchone() == (25, 24)
+
+    # A failing batch is rolled back and stops the load
+    stats = insert_logs(conn, "logs", df.assign(extra=1), batch_size=10)
+    assert stats["rows"] == 0
+    assert conn.execute("SELECT COUNT(*) FROM logs").fetchone() == (25,)
+
+def _load_dashboard():
+    # docs/dashboard.py is a script, not a package module
+    spec = importlib.util.spec_from_file_location(
+        "dashboard", os.path.join(os.path.dirname(__file__), "..", "docs", "dashboard.py"))
+    dashboard = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dashboard)
+    return dashboard
+
+def test_dashboard_labels_and_aggregates_large_uploads(monkeypatch):
+    dashboard = _load_dashboard()
+    rng = np.random.default_rng(6)
+    n = 3000
+    df = pd.DataFrame({'hour': rng.integers(0, 24, n), 'ip_freq': rng.integers(1, 200, n)},
+                      index=rng.permutation(n) + 10)
+    threat_indices = [0, 5, 5, 2999]
+    df = dashboard.label_threats(df, threat_indices)
+    assert df['threat'].sum() == 3 and df['threat'].iloc[[0, 5, 2999]].tolist() == [1, 1, 1]
+
+    monkeypatch.setattr(dashboard, 'DASHBOARD_NORMAL_SAMPLE', 100)
+    fig = dashboard.build_density_figure(df)
+    heatmap, normal, threats = fig.data
+    assert np.asarray(heatmap.z).shape == (dashboard.DASHBOARD_GRID_BINS, 24)
+    assert np.asarray(heatmap.z).sum() == n
+    assert len(normal.x) == 100
+    assert sorted(threats.text) == [1, 1, 1]
+
+    monkeypatch.setattr(dashboard, 'DASHBOARD_MAX_POINTS', 500)
+    assert isinstance(dashboard.build_figure(df).data[0], type(heatmap))
+    points = dashboard.build_figure(df, mode="points")
+    assert sum(len(trace.x) for trace in points.data) == 500
+    sampled = dashboard.sample_points(df, max_points=500)
+    assert sampled['threat'].sum() == 3
+
+def test_iter_new_log_features_advances_watermark(tmp_path):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE logs (timestamp TEXT, source_ip TEXT, message TEXT)")
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2025-09-28 12:00:00', periods=5, freq='min'),
+        'source_ip': ['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.3', '10.0.0.1'],
+        'message': ['ok', 'login failed', 'ok', 'error', 'ok'],
+    })
+    insert_logs(conn, "logs", df.iloc[:3])
+    watermark_path = str(tmp_path / "watermarks.json")
+
+    first = list(iter_new_log_features(conn, "logs", watermark_path=watermark_path, batch_size=2))
+    assert [len(features) for _, features in first] == [2, 1]
+    assert 'suspicious_flag' in first[0][1].columns
+
+    insert_logs(conn, "logs", df.iloc[3:])
+    second = list(iter_new_log_features(conn, "logs", watermark_path=watermark_path))
+    assert [clean['message'].tolist() for clean, _ in second] == [['error', 'ok']]
+
+def test_watermark_does_not_split_tied_timestamps(tmp_path):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE logs (timestamp TEXT, source_ip TEXT, message TEXT)")
+    insert_logs(conn, "logs", pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-09-28 12:00:00'] * 3 + ['2025-09-28 12:01:00']),
+        'source_ip': ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'],
+        'message': ['a', 'b', 'c', 'd'],
+    }))
+    watermark_path = str(tmp_path / "watermarks.json")
+
+    # Stop after the first batch: rows tied with its last row are not yet done
+    stream = iter_new_log_features(conn, "logs", watermark_path=watermark_path, batch_size=2)
+    seen = next(stream)[0]['message'].tolist()
+    next(stream)
+    stream.close()
+    rest = list(iter_new_log_features(conn, "logs", watermark_path=watermark_path, batch_size=2))
+    resumed = [m for clean, _ in rest for m in clean['message']]
+    assert seen == ['a', 'b'] and set(resumed) >= {'c', 'd'}
+    assert list(iter_new_log_features(conn, "logs", watermark_path=watermark_path)) == []
+
+def test_alert_dispatcher_coalesces_suppresses_and_retries():
+    received, statuses = [], [500]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            status = statuses.pop(0) if statuses else 200
+            if status == 200:
+                received.append(json.loads(body))
+            self.send_response(status)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        dispatcher = AlertDispatcher(
+            url=f"http://127.0.0.1:{server.server_port}/webhook",
+            coalesce_seconds=0.05, backoff_seconds=0.01, rate_limit=None,
+        )
+        assert dispatcher.submit([1, 2], key='batch') and dispatcher.submit([2, 3], key='batch')
+        time.sleep(0.3)
+        assert dispatcher.submit([1, 2, 3], key='batch')
+        dispatcher.close(timeout=5)
+    finally:
+        server.shutdown()
+
+    assert received == [{'alert': 'Threats detected', 'key': 'batch', 'indices': [1, 2, 3]}]
+    assert dispatcher.stats['retries'] == 1
+    assert dispatcher.stats['suppressed'] == 1
+
+def test_alert_dispatcher_prunes_keys_and_closes_with_full_queue():
+    release = threading.Event()
+
+    class SlowSession:
+        def post(self, url, json, timeout):
+            release.wait(5)
+            return type('Response', (), {'status_code': 200})()
+
+    dispatcher = AlertDispatcher(url='http://unused', queue_size=1, coalesce_seconds=0.0,
+                                 suppress_seconds=0.05, rate_limit=None, session=SlowSession())
+    release.set()
+    for key in range(3):
+        dispatcher.submit([key], key=f"batch-{key}")
+        time.sleep(0.1)
+    # Keys older than the suppression window are evicted on the next flush
+    assert set(dispatcher._last_sent) <= {'batch-2'}
+
+    release.clear()
+    dispatcher.submit([1], key='a')
+    time.sleep(0.05)
+    dispatcher.submit([2], key='b')  # worker is stuck posting 'a', so the queue is full
+    started = time.monotonic()
+    dispatcher.close(timeout=0.5)
+    assert time.monotonic() - started < 2
+    release.set()
+    dispatcher._thread.join(5)
+    assert not dispatcher._thread.is_alive() and dispatcher.stats['sent'] == 5
+
+def test_bulk_detect_streams_chunk_results(monkeypatch):
+    # Flag every suspicious row so the test does not depend on a saved model
+    monkeypatch.setattr(api, 'detect_threats',
+                        lambda features, **kwargs: np.flatnonzero(features['suspicious_flag'] == 1).tolist())
+    records = [
+        {'timestamp': '2025-09-28 12:00:00', 'source_ip': '10.0.0.1', 'message': 'ok'},
+        {'timestamp': '2025-09-28 12:00:01', 'source_ip': '10.0.0.2', 'message': 'login failed'},
+        {'timestamp': None, 'source_ip': '10.0.0.3', 'message': 'error'},
+        {'timestamp': '2025-09-28 12:00:03', 'source_ip': '10.0.0.4', 'message': 'unauthorized'},
+        {'timestamp': '2025-09-28 12:00:04', 'source_ip': '10.0.0.5', 'message': 'ok'},
+    ]
+    body = gzip.compress("\n".join(json.dumps(r) for r in records).encode())
+
+    client = api.app.test_client()
+    response = client.post('/detect/bulk?chunk_rows=2', data=body,
+                           headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/x-ndjson'})
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['offset'] for line in lines] == [0, 2, 4]
+    assert [line['threat_indices'] for line in lines] == [[1], [3], []]
+
+    class ChunkedInput:
+        # Raw wsgi.input of a chunked upload: read() only, short reads
+        def __init__(self, data):
+            self._data = data
+
+        def read(self, size=-1):
+            size = 7 if size < 0 else min(size, 7)
+            data, self._data = self._data[:size], self._data[size:]
+            return data
+
+    # Two gzip members, no Content-Length and no Content-Encoding header
+    body = gzip.compress(b"\n".join(json.dumps(r).encode() for r in records[:3]) + b"\n")
+    body += gzip.compress("\n".join(json.dumps(r) for r in records[3:]).encode())
+    response = client.post('/detect/bulk?chunk_rows=2', headers={'Transfer-Encoding': 'chunked'},
+                           environ_overrides={'wsgi.input': ChunkedInput(body),
+                                              'wsgi.input_terminated': True})
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['offset'] for line in lines] == [0, 2, 4]
+    assert [line['threat_indices'] for line in lines] == [[1], [3], []]
+
+def test_vectorized_threat_scores_match_row_rules():
+    df = pd.DataFrame({
+        'hour': [12, 3, 23, 12],
+        'ip_freq': [1, 10, 2, 4],
+        'suspicious_flag': [0, 1, 1, 0],
+    })
+    # 0 + 5 + 0, 50 + 30 + 18, 50 + 10 + 22, 0 + 20 + 0
+    assert apply_threat_scores(df.copy())['threat_score'].tolist() == [5, 98, 82, 20]
+
+    ranked = rank_threats(df, anomaly_scores=np.array([0.3, 0.1, 0.1, 0.2]), top_k=2)
+    assert ranked.index.tolist() == [1, 2]
+    assert np.isclose(ranked['combined_score'].iloc[0], 0.5 * 0.98 + 0.5 * 0.1)
+
+def test_refresh_model_replaces_oldest_trees():
+    rng = np.random.default_rng(0)
+    old = pd.DataFrame(rng.normal(size=(500, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    recent = pd.DataFrame(rng.normal(loc=2.0, size=(500, 3)), columns=old.columns)
+    model = train_model(old)
+    n_trees = len(model.estimators_)
+    newest = model.estimators_[-1]
+
+    model = refresh_model(model, recent, n_new_trees=10)
+    assert len(model.estimators_) == model.n_estimators == n_trees
+    assert model.estimators_[n_trees - 11] is newest
+    # The offset is recalibrated on the recent data at the configured contamination
+    assert abs((model.predict(recent) == -1).mean() - 0.1) < 0.01
+
+    # Every refresh draws its own seeds, so new trees are not copies of retired ones
+    seeds = [tuple(tree.random_state for tree in model.estimators_[-10:])]
+    for _ in range(2):
+        model = refresh_model(model, recent, n_new_trees=10)
+        seeds.append(tuple(tree.random_state for tree in model.estimators_[-10:]))
+    assert len(set(seeds)) == 3 and model.refresh_generation_ == 3
+    assert model.random_state == train_model(old).random_state
+
+def test_sharded_detection_matches_single_process(tmp_path):
+    rng = np.random.default_rng(1)
+    features = pd.DataFrame(rng.normal(size=(2000, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(features), path)
+
+    single = detect_threats(features, threshold=None, model_path=path)
+    sharded = detect_threats(features, threshold=None, n_workers=2, shard_rows=300, model_path=path)
+    assert single and sharded == single
+    np.testing.assert_allclose(
+        score_threats(features, n_workers=2, shard_rows=300, model_path=path),
+        score_threats(features, model_path=path),
+    )
+
+    # Concurrent requests share one pool, started without fork
+    import detector
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(detector._get_pool(3, path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(pool) for pool in pools}) == 1
+    assert pools[0]._mp_context.get_start_method() in ('forkserver', 'spawn')
+    detector._shutdown_pool()
+
+def test_compact_model_matches_sklearn_scores(tmp_path):
+    rng = np.random.default_rng(2)
+    features = pd.DataFrame(rng.normal(size=(1000, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    model = train_model(features)
+    path = str(tmp_path / "model.npz")
+    save_model(model, path)
+
+    compact = get_cached_model(path)
+    assert isinstance(compact, CompactForest)
+    np.testing.assert_allclose(compact.score_samples(features), model.score_samples(features), atol=1e-12)
+    np.testing.assert_array_equal(compact.predict(features), model.predict(features))
+    assert detect_threats(features, threshold=None, model_path=path) == np.flatnonzero(model.predict(features) == -1).tolist()
+
+def test_integer_ips_and_subnet_frequencies():
+    ips = ['10.0.0.1', '10.0.0.2', '10.0.1.1', '10.1.0.1', '2001:db8::1', '10.0.0.1']
+    ip_hi, ip_lo = parse_ips(ips)
+    assert ipv4_to_uint32(ip_lo)[0] == 0x0A000001
+    assert ip_hi[4] == 0x20010DB800000000 and ip_lo[4] == 1
+    assert list(format_ips(ip_hi, ip_lo)) == ips
+
+    df = preprocess_logs(pd.DataFrame({
+        'timestamp': ['2025-09-28 12:00:00'] * len(ips),
+        'source_ip': ips,
+        'message': ['ok'] * len(ips),
+    }))
+    assert df['source_ip'].dtype == 'category'
+    features = extract_features(df)
+    assert list(features['ip_freq']) == [2, 1, 1, 1, 1, 2]
+    assert list(features['ip_subnet24_freq']) == [3, 3, 1, 1, 1, 3]
+    assert list(features['ip_subnet16_freq']) == [4, 4, 4, 1, 1, 4]
+
+    # All-IPv4 batches keep one uint32 key per row instead of the 128-bit pair
+    v4_only = preprocess_logs(df[['timestamp', 'source_ip', 'message']].drop(index=4).astype({'source_ip': str}))
+    assert v4_only['ip_v4'].dtype == np.uint32 and 'ip_hi' not in v4_only.columns
+    assert 'ip_hi' in df.columns and 'ip_v4' not in df.columns
+    assert list(extract_features(v4_only)['ip_subnet24_freq']) == [3, 3, 1, 1, 3]
+
+    # Malformed addresses are not pooled into one frequent "IP"
+    bad = preprocess_logs(pd.DataFrame({
+        'timestamp': ['2025-09-28 12:00:00'] * 5,
+        'source_ip': ['10.0.0.1', 'bogus', 'not-an-ip', '999.1.1.1', '10.0.0.1'],
+        'message': ['ok'] * 5,
+    }))
+    bad_features = extract_features(bad)
+    assert list(bad_features['ip_freq']) == [2, 1, 1, 1, 2]
+    assert list(bad_features['ip_subnet24_freq']) == [2, 1, 1, 1, 2]
+    hi, lo = parse_ips(['bogus', None, '::1', '10.0.0.1'])
+    assert is_valid_ip(hi, lo).tolist() == [False, False, True, True]
+
+def test_dedup_scores_each_distinct_row_once(tmp_path):
+    rng = np.random.default_rng(3)
+    distinct = pd.DataFrame(rng.normal(size=(50, 3)), columns=['hour', 'ip_freq', 'suspicious_flag'])
+    features = distinct.iloc[rng.integers(0, 50, size=1000)].reset_index(drop=True)
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(distinct), path)
+
+    reset_detection_stats()
+    scores = score_threats(features, model_path=path)
+    stats = get_detection_stats()
+    assert stats["rows"] == 1000 and stats["scored_rows"] == features.drop_duplicates().shape[0]
+    assert stats["collapse_ratio"] == stats["rows"] / stats["scored_rows"]
+    np.testing.assert_array_equal(scores, score_threats(features, model_path=path, dedup=False))
+    assert detect_threats(features, threshold=None, model_path=path) == \
+        detect_threats(features, threshold=None, model_path=path, dedup=False)
+
+def test_cascade_clears_benign_rows_before_the_model(tmp_path):
+    rng = np.random.default_rng(4)
+    n = 400
+    logs = preprocess_logs(pd.DataFrame({
+        'timestamp': pd.Timestamp('2025-09-28') + pd.to_timedelta(rng.integers(0, 86400, n), unit='s'),
+        'source_ip': np.where(rng.random(n) < 0.5, '10.0.0.7', '203.0.113.9'),
+        'message': np.where(rng.random(n) < 0.2, 'login failed', 'ok'),
+    }))
+    features = extract_features(logs)
+    path = str(tmp_path / "model.pkl")
+    save_model(train_model(features), path)
+
+    cleared = cascade_prefilter(features, logs)
+    expected = ((features['suspicious_flag'] == 0) & features['hour'].between(8, 17)
+                & (logs['source_ip'] == '10.0.0.7')).to_numpy()
+    np.testing.assert_array_equal(cleared, expected)
+    # Without the logs the source rule cannot run, so nothing is cleared
+    assert not cascade_prefilter(features).any()
+
+    reset_detection_stats()
+    threats = detect_threats(features, threshold=None, model_path=path, cascade=True, logs=logs)
+    full = detect_threats(features, threshold=None, model_path=path)
+    assert threats == [i for i in full if not cleared[i]]
+    stats = get_detection_stats()
+    assert stats["cascade_cleared"] == cleared.sum()
+    assert stats["model_rows"] == 2 * n - cleared.sum()
+
+def test_hashed_text_features_stay_sparse(tmp_path):
+    rng = np.random.default_rng(5)
+    messages = np.array(['user login ok', 'health check ok', 'login failed for root', 'disk error on sda'])
+    logs = preprocess_logs(pd.DataFrame({
+        'timestamp': ['2025-09-28 12:00:00'] * 600,
+        'source_ip': rng.choice(['10.0.0.1', '10.0.0.2'], 600),
+        'message': rng.choice(messages, 600),
+    }))
+    features = extract_features(logs)
+    X = build_model_input(features, logs, text_features=True)
+    assert X.format == 'csr' and X.shape[0] == len(logs)
+    assert X.nnz < 20 * X.shape[0]
+
+    model = train_model(X)
+    path = str(tmp_path / "model.npz")
+    save_model(model, path)
+    np.testing.assert_allclose(get_cached_model(path).score_samples(X), model.score_samples(X), atol=1e-12)
+    expected = np.flatnonzero(model.predict(X) == -1).tolist()
+    assert detect_threats(X, threshold=None, model_path=path) == expected
+    assert detect_threats(X, threshold=None, model_path=path, dedup=False) == expected
+
+    # Ranking scores the same combined input the model was trained on
+    ranked = rank_threats(features, logs=logs, text_features=True, model_path=path)
+    np.testing.assert_allclose(ranked['anomaly_score'].sort_index(), -model.score_samples(X), atol=1e-12)
+    from_matrix = rank_threats(X, top_k=5, model_path=path)
+    assert len(from_matrix) == 5 and (from_matrix['rule_score'] == 0).all()
+    assert rank_threats(X[:0], model_path=path).empty
+
+def test_index_encodings_round_trip(monkeypatch):
+    indices = np.concatenate([np.arange(100, 5000), [7, 9000], np.arange(9100, 9200)])
+    for encoding in ('list', 'ranges', 'bitmap', 'auto'):
+        payload = json.loads(json.dumps(encode_indices(indices, encoding)))
+        decoded = decode_indices(payload)
+        if encoding == 'list':
+            np.testing.assert_array_equal(decoded, indices)
+        else:
+            np.testing.assert_array_equal(decoded, np.sort(indices))
+    assert encode_indices(indices, 'ranges')['ranges'][:2] == [[7, 8], [100, 5000]]
+    assert encode_indices(indices, 'auto')['encoding'] != 'list'
+    assert decode_indices(encode_indices([], 'bitmap')).size == 0
+
+    monkeypatch.setattr(api, 'detect_threats',
+                        lambda features, **kwargs: np.flatnonzero(features['suspicious_flag'] == 1))
+    records = [{'timestamp': '2025-09-28 12:00:00', 'source_ip': '10.0.0.1', 'message': m}
+               for m in ['ok', 'login failed', 'error', 'ok']]
+    client = api.app.test_client()
+    response = client.post('/detect?encoding=ranges', json=records)
+    assert response.get_json()['threat_indices'] == {'encoding': 'ranges', 'ranges': [[1, 3]]}
+    assert client.post('/detect?encoding=zip', json=records).status_code == 400
+
+def test_result_store_partitions_indexes_and_rolls_up(tmp_path):
+    logs = preprocess_logs(pd.DataFrame({
+        'timestamp': ['2025-09-28 23:10:00', '2025-09-28 23:20:00', '2025-09-29 01:00:00',
+                      '2025-09-29 01:30:00', '2025-09-29 02:00:00'],
+        'source_ip': ['10.0.0.1', '10.0.0.2', '10.0.0.1', '2001:db8::1', '10.0.0.1'],
+        'message': ['ok'] * 5,
+    }))
+    store = ResultStore(str(tmp_path / "results"))
+    assert store.write(logs, [0, 2, 3, 4]) == 4
+    assert sorted(p.name for p in (tmp_path / "results").iterdir()) == ['day=2025-09-28', 'day=2025-09-29']
+
+    hits = store.query(source_ip='10.0.0.1')
+    assert list(hits['row']) == [0, 2, 4]
+    hits = store.query(start='2025-09-29', end='2025-09-29 02:00', source_ip='10.0.0.1')
+    assert list(hits['row']) == [2]
+    assert list(store.query(source_ip='2001:db8::1')['source_ip']) == ['2001:db8::1']
+    assert store.query(source_ip='10.9.9.9').empty
+
+    rollups = store.hourly_rollups(start='2025-09-29')
+    assert list(rollups['rows']) == [2, 1] and list(rollups['threats']) == [2, 1]
+    assert store.hourly_rollups()['rows'].sum() == 5
+
+def test_result_store_keyed_writes_replace_earlier_runs(tmp_path):
+    logs = preprocess_logs(pd.DataFrame({
+        'timestamp': ['2025-09-28 23:10:00', '2025-09-29 01:00:00', '2025-09-29 02:00:00'],
+        'source_ip': ['10.0.0.1', '10.0.0.2', '10.0.0.1'],
+        'message': ['ok'] * 3,
+    }))
+    store = ResultStore(str(tmp_path / "results"), cache_parts=1)
+    store.write(logs, [0, 1], key='logs.csv')
+    store.write(logs, [0, 1, 2], key='logs.csv')
+    assert list(store.query()['row']) == [0, 1, 2]
+    assert store.hourly_rollups()['rows'].sum() == 3
+    # A rerun that no longer covers a day drops that day's old part
+    store.write(logs.iloc[1:], [1], key='logs.csv')
+    assert list(store.query()['row']) == [1]
+    assert len(store._parts) == 1
+
+    # Logs without timestamp or source IP are skipped instead of raising
+    assert store.write(pd.DataFrame({'message': ['ok']}), [0]) == 0
+
+def test_reservoir_sample_is_bounded_uniform_and_stratified(tmp_path):
+    sampler = ReservoirSampler(size=1000, seed=0)
+    for start in range(0, 20000, 3000):
+        sampler.add(pd.DataFrame({'value': np.arange(start, min(start + 3000, 20000))}))
+    sample = sampler.sample()
+    assert len(sample) == 1000 and sample['value'].is_unique
+    # Every part of the stream is represented about equally
+    assert np.histogram(sample['value'], bins=4, range=(0, 20000))[0].min() > 200
+
+    hours = np.repeat([1, 2, 3], [5000, 50, 5])
+    sampler = ReservoirSampler(size=40, seed=0)
+    sampler.add(pd.DataFrame({'hour': hours}), strata=hours)
+    # The budget is shared: small strata keep all rows, the rest split evenly
+    assert sampler.sample()['hour'].value_counts().to_dict() == {1: 17, 2: 17, 3: 5}
+    ips = np.arange(5000) % 2500
+    sampler = ReservoirSampler(size=100, seed=0)
+    for start in range(0, 5000, 1000):
+        sampler.add(pd.DataFrame({'ip': ips[start:start + 1000]}), strata=ips[start:start + 1000])
+    assert len(sampler.sample()) == 100
+
+    logs = pd.DataFrame({
+        'timestamp': pd.date_range('2025-09-28', periods=3000, freq='min').astype(str),
+        'source_ip': np.where(np.arange(3000) % 3, '10.0.0.1', '10.0.0.2'),
+        'message': 'ok',
+    })
+    logs.to_csv(tmp_path / 'a.csv', index=False)
+    logs.to_csv(tmp_path / 'b.csv', index=False)
+    training = build_training_sample(str(tmp_path), size=240, stratify='hour', batch_rows=500)
+    assert len(training) == 240 and {'hour', 'ip_freq'} <= set(training.columns)
+    assert (training['hour'].value_counts() == 10).all()
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _use_src_registry(tmp_path, monkeypatch):
+    # The FastAPI service modules live under src/ and read config/config.yaml
+    # from the repo root; the registry is pointed at tmp_path via its env override
+    pytest.importorskip("dotenv")
+    monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, "src"))
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setenv("MODELS_REGISTRY_DIR", str(tmp_path))
+    monkeypatch.setattr(src_config_module(), "_config_instance", None)
+    from utils.model_registry import get_registry
+    return get_registry()
+
+def src_config_module():
+    from utils import config as src_config
+    return src_config
+
+def _constant_model(value):
+    from sklearn.dummy import DummyClassifier
+    X = pd.DataFrame({'hour': [0, 1], 'ip_freq': [1, 1], 'suspicious_flag': [0, 1]})
+    return DummyClassifier(strategy='constant', constant=value).fit(X, [value, value + 1])
+
+def test_registry_engine_refreshes_and_hot_swaps(tmp_path, monkeypatch):
+    registry = _use_src_registry(tmp_path, monkeypatch)
+    from models.inference import InferenceEngine
+
+    assert registry.latest_version('clf') == 0
+    registry.save_model(_constant_model(1), 'clf')
+    assert registry.latest_version('clf') == 1
+    engine = InferenceEngine(model_name='clf')
+    record = {'hour': 3, 'ip_freq': 2, 'suspicious_flag': 0}
+    assert engine.model_version == 1 and engine.predict(record) == [1]
+    assert not engine.refresh()
+
+    metadata = registry.save_model(_constant_model(2), 'clf')
+    # Metadata is in place before the pickle, and describes exactly that file
+    with open(tmp_path / 'clf_v2.json') as f:
+        assert json.load(f) == metadata
+    with open(tmp_path / 'clf_v2.pkl', 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == metadata['fingerprint_sha256']
+    assert not list(tmp_path.glob('*.tmp'))
+
+    in_flight = engine._current
+    assert engine.refresh() and engine.model_version == 2 and engine.predict(record) == [2]
+    # A request that read the old model keeps using it
+    assert in_flight[1].predict(pd.DataFrame([record])).tolist() == [1]
+
+    engine.start_watcher(0.05)
+    try:
+        registry.save_model(_constant_model(3), 'clf')
+        deadline = time.monotonic() + 5
+        while engine.model_version != 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        engine.stop_watcher(timeout=5)
+    assert engine.model_version == 3 and engine.predict(record) == [3]
+
+    # The API's pipeline accessor builds one warm engine per process
+    from models import inference
+    from pipelines import inference_pipeline
+    monkeypatch.setenv('INFERENCE_MODEL_NAME', 'clf')
+    monkeypatch.setenv('INFERENCE_RELOAD_INTERVAL_SECONDS', '0')
+    monkeypatch.setattr(src_config_module(), '_config_instance', None)
+    monkeypatch.setattr(inference, '_engine', None)
+    monkeypatch.setattr(inference_pipeline, '_pipeline', None)
+    pipeline = inference_pipeline.get_inference_pipeline()
+    assert inference_pipeline.get_inference_pipeline() is pipeline
+    assert pipeline.engine.model_version == 3 and pipeline.predict([record, record]) == [3, 3]
+    # Records the batcher would otherwise mean-impute from other callers
+    pipeline.validate_record(record)
+    with pytest.raises(ValueError, match='ip_freq'):
+        pipeline.validate_record({'hour': 3, 'ip_freq': None, 'suspicious_flag': 0})
+    with pytest.raises(ValueError, match='suspicious_flag'):
+        pipeline.validate_record({'hour': 3, 'ip_freq': 2})
+
+def _micro_batching(monkeypatch):
+    # Pure asyncio, no dotenv / fastapi needed
+    monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, "src"))
+    from pipelines import micro_batching
+    return micro_batching
+
+def test_micro_batcher_coalesces_and_isolates_bad_records(monkeypatch):
+    micro_batching = _micro_batching(monkeypatch)
+    calls = []
+
+    def predict(records):
+        calls.append(len(records))
+        if any(r["x"] is None for r in records):
+            raise ValueError("missing x")
+        return [r["x"] * 10 for r in records]
+
+    def validate(record):
+        if "x" not in record:
+            raise ValueError("no x")
+
+    async def scenario():
+        batcher = micro_batching.MicroBatcher(predict, max_batch_size=4, max_wait_ms=20,
+                                              validate_fn=validate)
+        batcher.start()
+        try:
+            results = await asyncio.gather(
+                *(batcher.submit({"x": i}) for i in range(10)),
+                batcher.submit({"x": None}), batcher.submit({}),
+                return_exceptions=True,
+            )
+        finally:
+            await batcher.stop()
+        return batcher, results
+
+    batcher, results = asyncio.run(scenario())
+    assert results[:10] == [i * 10 for i in range(10)]
+    assert isinstance(results[10], ValueError) and str(results[10]) == "missing x"
+    # Rejected before queueing: never reaches predict or the histograms
+    assert isinstance(results[11], ValueError) and str(results[11]) == "no x"
+
+    metrics = batcher.metrics()
+    assert metrics["requests"] == 11 and metrics["rejected"] == 1
+    # 11 queued records coalesce into ceil(11 / 4) batches of at most 4
+    assert metrics["batches"] == 3 and metrics["failed_batches"] == 1
+    assert metrics["batch_size"]["count"] == 3 and metrics["batch_size"]["sum"] == 11
+    assert metrics["batch_size"]["buckets"]["2"] == 0 and metrics["batch_size"]["buckets"]["4"] == 3
+    assert metrics["queue_wait_ms"]["count"] == 11
+    assert metrics["queue_wait_ms"]["buckets"]["+Inf"] == 11
+    # Three batch calls plus per-record retries for the failed batch of 3
+    assert calls == [4, 4, 3, 1, 1, 1]
+
+def test_micro_batcher_histogram_is_cumulative(monkeypatch):
+    histogram = _micro_batching(monkeypatch).Histogram((1, 5, 10))
+    for value in (0.5, 1, 3, 7, 50):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"1": 2, "5": 3, "10": 4, "+Inf": 5}
+    assert snapshot["count"] == 5 and snapshot["sum"] == 61.5
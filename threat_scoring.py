@@ -0,0 +1,78 @@
+# threat_scoring.py
+
+import logging
+import numpy as np
+import pandas as pd
+from detector import score_threats, select_threats
+from feature_engineering import build_model_input
+from config import (
+    THREAT_SCORE_WEIGHTS, THREAT_SCORE_CAPS, THREAT_SCORE_ANOMALY_WEIGHT,
+    DETECT_MODEL_PATH, TEXT_HASH_FEATURES, LOG_LEVEL,
+)
+
+logging.basicConfig(level=LOG_LEVEL)
+
+def score_rules(features, weights=THREAT_SCORE_WEIGHTS, caps=THREAT_SCORE_CAPS):
+    # Rule points for every row at once; rules whose column is missing score 0
+    # (so does every rule on a scipy.sparse model input, which has no names)
+    score = np.zeros(features.shape[0], dtype=np.float64)
+    columns = getattr(features, 'columns', ())
+
+    def rule(name, values):
+        points = weights.get(name, 0) * values
+        cap = caps.get(name)
+        return np.minimum(points, cap) if cap is not None else points
+
+    if 'suspicious_flag' in columns:
+        score += rule('suspicious_flag', (features['suspicious_flag'].to_numpy() != 0).astype(np.float64))
+    if 'ip_freq' in columns:
+        score += rule('ip_freq', features['ip_freq'].to_numpy(dtype=np.float64))
+    if 'hour' in columns:
+        # off-peak hours: distance from midday
+        score += rule('off_hours', np.abs(features['hour'].to_numpy(dtype=np.float64) - 12))
+
+    total_cap = caps.get('total')
+    return np.minimum(score, total_cap) if total_cap is not None else score
+
+def apply_threat_scores(df, weights=THREAT_SCORE_WEIGHTS, caps=THREAT_SCORE_CAPS):
+    df["threat_score"] = score_rules(df, weights=weights, caps=caps)
+    return df
+
+def rank_threats(features, anomaly_scores=None, anomaly_weight=THREAT_SCORE_ANOMALY_WEIGHT,
+                 top_k=None, weights=THREAT_SCORE_WEIGHTS, caps=THREAT_SCORE_CAPS, logs=None,
+                 text_features=TEXT_HASH_FEATURES, model_path=DETECT_MODEL_PATH):
+    # Blends the rule score (scaled to 0-1 by the total cap) with the
+    # IsolationForest anomaly score and returns rows ranked by the result.
+    # features is the extract_features frame; without anomaly_scores the
+    # model scores build_model_input(features, logs), the input it was
+    # trained on (hashed message n-grams need logs, the preprocessed rows).
+    if features.shape[0] == 0:
+        logging.warning("Empty feature set received for threat ranking.")
+        return pd.DataFrame(columns=["rule_score", "anomaly_score", "combined_score"])
+
+    rule_score = score_rules(features, weights=weights, caps=caps)
+    scale = caps.get('total') or rule_score.max() or 1.0
+    rule_part = rule_score / scale
+
+    if anomaly_scores is None:
+        model_input = features
+        if hasattr(features, 'columns'):
+            model_input = build_model_input(features, features if logs is None else logs,
+                                            text_features=text_features)
+        anomaly_scores = score_threats(model_input, model_path=model_path)
+    anomaly_scores = np.asarray(anomaly_scores, dtype=np.float64)
+    if anomaly_scores.size == 0:
+        logging.warning("No anomaly scores available, ranking by rule score only.")
+        anomaly_scores = np.full(features.shape[0], np.nan)
+        combined = rule_part
+    else:
+        combined = (1 - anomaly_weight) * rule_part + anomaly_weight * anomaly_scores
+
+    order = select_threats(combined, threshold=None,
+                           top_k=top_k if top_k is not None else features.shape[0])
+    ranked = pd.DataFrame({
+        "rule_score": rule_score,
+        "anomaly_score": anomaly_scores,
+        "combined_score": combined,
+    }, index=getattr(features, 'index', None))
+    return ranked.iloc[order]
@@ -0,0 +1,141 @@
+# timestamp_parser.py
+
+import logging
+import pandas as pd
+from config import TIMESTAMP_SAMPLE_SIZE, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Tried in order against a sample; the first one that parses (almost) every
+# sampled value wins. "ISO8601" is pandas' C ISO parser: it covers every ISO
+# variant and is what pandas' own inference uses, so it goes first. The
+# exact formats are for what pandas cannot infer, where its per-row
+# fallback is an order of magnitude slower.
+CANDIDATE_FORMATS = [
+    "ISO8601",
+    "%d/%b/%Y:%H:%M:%S %z",
+    "%Y/%m/%d %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%Y%m%d%H%M%S",
+    "%Y%m%d",
+]
+
+# Epoch units and their size in seconds. A numeric column is only read as
+# epoch time when (almost) every value lands in EPOCH_RANGE_SECONDS
+# (1990-01-01 .. 2100-01-01) for one unit, i.e. 10 digits for s, 13 for ms,
+# 16 for us, 19 for ns; compact dates like 20250928 do not qualify.
+EPOCH_UNITS = [("s", 1.0), ("ms", 1e3), ("us", 1e6), ("ns", 1e9)]
+EPOCH_RANGE_SECONDS = (631152000, 4102444800)
+
+MIN_MATCH_RATIO = 0.9
+
+# source -> detected format
+_format_cache = {}
+
+def detect_timestamp_format(series, sample_size=TIMESTAMP_SAMPLE_SIZE):
+    # Sample from the head: a full-column dropna costs as much as parsing
+    sample = series.head(sample_size).dropna()
+    if sample.empty:
+        sample = series.dropna().head(sample_size)
+    if sample.empty:
+        return None
+
+    numeric = pd.to_numeric(sample, errors="coerce")
+    if numeric.notna().mean() >= MIN_MATCH_RATIO:
+        low, high = EPOCH_RANGE_SECONDS
+        for unit, scale in EPOCH_UNITS:
+            seconds = numeric / scale
+            if ((seconds >= low) & (seconds < high)).mean() >= MIN_MATCH_RATIO:
+                return f"epoch_{unit}"
+
+    sample = sample.astype(str)
+    best, best_ratio = None, 0.0
+    for fmt in CANDIDATE_FORMATS:
+        try:
+            ratio = _to_datetime(sample, format=fmt).notna().mean()
+        except (ValueError, TypeError):
+            continue
+        if ratio >= MIN_MATCH_RATIO:
+            return fmt
+        if ratio > best_ratio:
+            best, best_ratio = fmt, ratio
+    return best
+
+def _to_datetime(values, **kwargs):
+    # utc=True: offsets that change within the data (e.g. across a DST
+    # switch) or offset and naive values side by side parse in one pass;
+    # naive values come back as the same wall time
+    return pd.to_datetime(values, errors="coerce", utc=True, **kwargs)
+
+def _parse_with_format(series, fmt):
+    if fmt.startswith("epoch_"):
+        unit = fmt.split("_", 1)[1]
+        return pd.to_datetime(pd.to_numeric(series, errors="coerce"), unit=unit, errors="coerce")
+    return _to_datetime(series, format=fmt)
+
+def _parse_mixed(series):
+    # Whole-series slow path
+    return _to_datetime(series, format="mixed")
+
+def _to_naive_utc(parsed):
+    # One convention for every path: tz-aware results become naive UTC wall
+    # time, naive ones are kept as is (result_store reads them the same way)
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        parsed = parsed.dt.tz_convert("UTC").dt.tz_localize(None)
+    return parsed
+
+def _failed_rows(parsed, series):
+    # NaT results for non-null input; the input's own null check only runs
+    # on the NaT rows, as it is as slow as parsing on a long object column
+    failed = parsed.isna()
+    if failed.any():
+        failed[failed] = series[failed].notna()
+    return failed
+
+def _parse_failed(series):
+    # Rows the main format missed: most often a second format that a few
+    # lines use, so it is detected and parsed exactly before the per-row
+    # mixed parser gets whatever is left
+    fmt = detect_timestamp_format(series)
+    if fmt is None:
+        return _to_naive_utc(_parse_mixed(series))
+    parsed = _to_naive_utc(_parse_with_format(series, fmt))
+    failed = _failed_rows(parsed, series)
+    if failed.any():
+        parsed[failed] = _to_naive_utc(_parse_mixed(series[failed].astype(str)))
+    return parsed
+
+def parse_timestamps(series, source=None):
+    # Returns naive datetimes; values with an offset are converted to UTC
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return _to_naive_utc(series)
+
+    fmt = _format_cache.get(source) if source is not None else None
+    cached = fmt is not None
+    if fmt is None:
+        fmt = detect_timestamp_format(series)
+    if fmt is None:
+        return _to_naive_utc(_parse_mixed(series))
+
+    parsed = _to_naive_utc(_parse_with_format(series, fmt))
+    failed = _failed_rows(parsed, series)
+
+    # A cached format that stopped matching means the source changed format
+    if cached and failed.mean() > 1 - MIN_MATCH_RATIO:
+        logging.info(f"Cached timestamp format for {source} no longer matches, re-detecting.")
+        fmt = detect_timestamp_format(series)
+        if fmt is None:
+            return _to_naive_utc(_parse_mixed(series))
+        parsed = _to_naive_utc(_parse_with_format(series, fmt))
+        failed = _failed_rows(parsed, series)
+
+    if source is not None:
+        _format_cache[source] = fmt
+
+    if failed.any():
+        parsed[failed] = _parse_failed(series[failed])
+        logging.info(f"Parsed {int(failed.sum())} timestamps with the fallback path.")
+    return parsed
+
+def clear_format_cache():
+    _format_cache.clear()
@@ -0,0 +1,107 @@
+# training_sample.py
+
+import logging
+import numpy as np
+import pandas as pd
+from data_loader import load_log_batches, preprocess_logs
+from feature_engineering import extract_features, build_model_input
+from config import (
+    LOG_DATA_PATH, TRAIN_SAMPLE_SIZE, TRAIN_SAMPLE_STRATIFY, TRAIN_SAMPLE_BATCH_ROWS,
+    TEXT_HASH_FEATURES, RANDOM_SEED, LOG_LEVEL,
+)
+
+logging.basicConfig(level=LOG_LEVEL)
+
+_KEY = "_sample_key"
+_STRATUM = "_sample_stratum"
+
+def _stratum_cap(counts, size):
+    # Largest per-stratum cap c with sum(min(count, c)) <= size (water-filling):
+    # strata smaller than an equal share keep everything and the rest of the
+    # budget is split evenly over the larger ones
+    counts = np.sort(np.asarray(counts))
+    used = 0
+    for i, count in enumerate(counts):
+        share = (size - used) // (len(counts) - i)
+        if count > share:
+            return share
+        used += count
+    return int(counts[-1]) if len(counts) else size
+
+class ReservoirSampler:
+    # Uniform sample without replacement of up to `size` rows from a stream of
+    # DataFrame batches. Every row draws a random key and the sample is the
+    # rows with the `size` largest keys seen so far, which is what one-row-
+    # at-a-time reservoir sampling yields, but each batch is merged in a
+    # single vectorized step. With strata the `size` budget is shared: each
+    # stratum keeps its largest keys up to a common cap, so the sample stays
+    # uniform within every stratum and memory is bounded by size plus one
+    # batch however many strata there are.
+
+    def __init__(self, size=TRAIN_SAMPLE_SIZE, seed=RANDOM_SEED):
+        if size <= 0:
+            raise ValueError("size must be positive")
+        self.size = int(size)
+        self.rows_seen = 0
+        self._rng = np.random.default_rng(seed)
+        self._sample = None
+
+    def add(self, batch, strata=None):
+        if batch.empty:
+            return
+        batch = batch.reset_index(drop=True).assign(**{
+            _KEY: self._rng.random(len(batch)),
+            _STRATUM: 0 if strata is None else np.asarray(strata),
+        })
+        self.rows_seen += len(batch)
+        merged = batch if self._sample is None else pd.concat([self._sample, batch], ignore_index=True)
+
+        # Largest keys first within each stratum, then keep the first `cap`
+        merged = merged.sort_values([_STRATUM, _KEY], ascending=[True, False], kind="stable")
+        groups = merged.groupby(_STRATUM, sort=False)
+        cap = _stratum_cap(groups.size().to_numpy(), self.size)
+        if cap > 0:
+            keep = groups.cumcount().to_numpy() < cap
+        else:
+            # More strata than budget: the `size` largest keys overall
+            keep = merged[_KEY].rank(method="first", ascending=False).to_numpy() <= self.size
+        self._sample = merged[keep].reset_index(drop=True)
+
+    def sample(self):
+        if self._sample is None:
+            return pd.DataFrame()
+        return self._sample.drop(columns=[_KEY, _STRATUM]).reset_index(drop=True)
+
+def _strata(clean, features, stratify):
+    if stratify is None:
+        return None
+    if stratify == "hour":
+        return features["hour"].to_numpy()
+    if stratify == "source":
+        return clean["source_ip"].astype(str).to_numpy()
+    raise ValueError(f"Unknown stratification: {stratify}")
+
+def build_training_sample(paths=LOG_DATA_PATH, size=TRAIN_SAMPLE_SIZE, stratify=TRAIN_SAMPLE_STRATIFY,
+                          batch_rows=TRAIN_SAMPLE_BATCH_ROWS, text_features=TEXT_HASH_FEATURES,
+                          seed=RANDOM_SEED):
+    # One pass over every log file: each batch is preprocessed and featurized
+    # on its own (so batch-relative features such as ip_freq are per batch),
+    # then merged into the reservoir. Returns what train_model accepts.
+    sampler = ReservoirSampler(size, seed=seed)
+    for batch in load_log_batches(paths, batch_rows=batch_rows):
+        clean = preprocess_logs(batch)
+        features = extract_features(clean)
+        if features.empty:
+            continue
+        if text_features and "message" in clean.columns:
+            # Hashed n-grams are stateless, so they can be built from the
+            # sampled messages once sampling is done
+            features = features.assign(message=clean["message"].to_numpy())
+        sampler.add(features, _strata(clean, features, stratify))
+
+    sample = sampler.sample()
+    logging.info(f"Sampled {len(sample)} of {sampler.rows_seen} feature rows for training.")
+    if "message" in sample.columns:
+        return build_model_input(sample.drop(columns=["message"]), sample[["message"]],
+                                 text_features=True)
+    return sample